@@ -1,12 +1,41 @@
 import sys
 import os
 import re
+import mmap
+import time
+import io
+import cProfile
+import pstats
+import tempfile
+import shutil
+import gzip
+import bz2
+import lzma
 import warnings
-from functools import reduce
-from itertools import combinations
+import threading
+import queue
+import hashlib
+import json
+import zlib
+import copy
+import tracemalloc
+import socket
+import socketserver
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections.abc import Mapping
+from contextlib import nullcontext, contextmanager
+from functools import reduce, lru_cache
+from operator import itemgetter
 from typing import List, Dict
 from datetime import datetime
 
+try:
+	import resource
+except ImportError: # Not available on Windows
+	resource = None
+
 documentation = {
 
 	'DOI': '[![DOI](https://zenodo.org/badge/DOI/10.5281/zenodo.10028408.svg)](https://doi.org/10.5281/zenodo.10028408)',
@@ -16,11 +45,15 @@ documentation = {
 	'Installation': 'Simply clone the GitHub repository or download the main script (`bad2matrix.py`). A Python 3 interpreter is required.',
 
 	'Usage': {
-		'command': 'python bad2matrix.py -d <directory> -n <root-name> [-a 2|3|4|5|6|6dso|6kgb|6sr|8|10|11|12|15|18|20] [-f] [-g] [-i] [-m int] [-t <directory>]',
+		'command': 'python bad2matrix.py -d <directory> -n <root-name> [-a 2|3|4|5|6|6dso|6kgb|6sr|8|10|11|12|15|18|20[,...]] [-b <manifest>] [-c] [-f] [-g] [-i] [-m int] [-p int] [-s format [path]] [-z gzip|xz] [--cache <directory>] [--cache-size MB] [--memory MB] [--plan [file]] [--profile [file]] [--serve <socket>] [-t <directory>]',
 
 		'options':{
-			'-a': 'Number of amino acid states (default = 20). Reduction with option `6dso` follows [Dayhoff et al. (1978)](http://chagall.med.cornell.edu/BioinfoCourse/PDFs/Lecture2/Dayhoff1978.pdf); option `6kgb` follows [Kosiol et al. (2004)](https://doi.org/10.1016/j.jtbi.2003.12.010); option `6sr` follows [Susko and Roger (2007)](https://doi.org/10.1093/molbev/msm144); option `11` follows [Buchfink et al. (2015)](https://doi.org/10.1038/nmeth.3176); and all other options follow [Murphy et al. (2000)](https://doi.org/10.1093/protein/13.3.149).',
+			'-a': 'Number of amino acid states (default = 20). Reduction with option `6dso` follows [Dayhoff et al. (1978)](http://chagall.med.cornell.edu/BioinfoCourse/PDFs/Lecture2/Dayhoff1978.pdf); option `6kgb` follows [Kosiol et al. (2004)](https://doi.org/10.1016/j.jtbi.2003.12.010); option `6sr` follows [Susko and Roger (2007)](https://doi.org/10.1093/molbev/msm144); option `11` follows [Buchfink et al. (2015)](https://doi.org/10.1038/nmeth.3176); and all other options follow [Murphy et al. (2000)](https://doi.org/10.1093/protein/13.3.149). Several alphabets can be given separated by commas (e.g. `-a 20,6dso,6kgb,11`): alignments are then parsed, indel-coded, and scanned for informative characters once for all of them, and a set of output files is written for each alphabet, the code of the alphabet being appended to the root name (e.g. `test_6dso`).',
 			
+			'-b': 'Batch mode: build a series of matrices from a manifest, a text file with one configuration per line made of a root name followed by any of the options `-a`, `-g`, `-i`, and `-m` (e.g. `test_m50 -m 50 -g`; blank lines and lines starting with `#` are skipped). Options given in the command line are the defaults of all configurations, and `-n` is not needed. Input files are indexed, parsed, indel-coded, and scanned for informative characters once for the whole batch, and each configuration is written under its own root name (configurations with several alphabets as in `-a`). Alignments retained by several `-m` thresholds are kept processed in a temporary cache (or in `--cache`) between them. `--batch` can be used as well.',
+
+			'-c': 'Hold each FASTA partition as a columnar matrix of bytes (taxa x columns) instead of a dictionary of strings. Indel coding and informative character counting then work on whole rows and columns at a time, which is considerably faster on large datasets. Output files are identical in both modes.',
+
 			'-d': 'The input directory of aligned FASTA files. The default behavior aggregates sequences of the same species across partitions, in which case names should use the following convention: `>species#sequenceID`. This implies that a species can be represented by only one read within each FASTA file. Characters other than letters, numbers, periods, and underscores will be deleted. Use `-f` for an alternate naming convention.',
 			
 			'-f': 'Use full FASTA names rather than default settings (see `-d` description for default). Sequences from the same species but different reads will not be aggregated and will be considered distinct OTUs. Characters other than letters, numbers, periods, and underscores will be deleted.',
@@ -31,20 +64,40 @@ documentation = {
 			
 			'-m': 'Retain the upper `x` percentile of genes in the distribution of missing sequences. By default `x` = 1 (i.e. include all genes with four or more sequences).',
 			
-			'-n': 'Specify the root-name for output files.',
+			'-n': 'Specify the root-name for output files (not used with `-b`).',
 			
+			'--cache': 'Directory of a cache of processed FASTA alignments (parsed, indel-coded, and with their informative characters found). Alignments are identified by their content, the names given to their terminals, and the options `-a` and `-i`, so only new or modified alignments are processed when a matrix is rebuilt; the rest are read from the cache. Not used with `--memory`.',
+
+			'--cache-size': 'Maximum size of the cache in megabytes (default = 4096). Least recently used alignments are removed from the cache beyond it. Also the memory budget of the alignments kept by `--serve`.',
+
+			'--memory': 'Stream each FASTA alignment straight to the temporary file in blocks of columns taking about `MB` megabytes of memory, instead of reading it whole. Informative characters and indels are found block by block, so alignments much larger than the available memory (e.g. whole plastomes of thousands of terminals) can be processed. Alignments are then processed one at a time (`-p` is ignored). Output files are identical.',
+
+			'-p': 'Number of processes used to parse, indel-code, and find informative characters of the FASTA alignments (default = 1), and of threads used to index (and decompress) the input files. Alignments are dispatched largest first and gathered back in input order, so output files do not depend on this option. `--processes` can be used as well.',
+
+			'--plan': 'Dry run: estimate the matrix without building it, so the resources of a job can be requested beforehand. Input files are indexed and the files retained by `-m` found, then 256 evenly spaced columns of each alignment are sampled for informative characters, and its gap runs counted for indel characters. The plan lists each file (terminals, characters, informative and indel characters), the occupancy, the size of each output file (uncompressed), the disk space taken along with the temporary spool, the peak memory, and the runtime. Runtime and memory are extrapolated from processing a slice of about a million characters of the largest alignment on the machine running the plan (`-p` is taken into account, `--memory` is not). If followed by a file name, the plan is also saved in it as JSON. With `-a` or `-b`, each configuration is planned.',
+
+			'--profile': 'Record wall time, CPU time, bytes read and written, and peak RSS of each stage of the pipeline (name mapping, partition parsing, indel coding, informative characters, gene content coding, and each output writer) in the execution log. If followed by a file name, a cProfile dump of the whole run is saved in it and the slowest functions are listed in the log as well.',
+
+			'--serve': 'Server mode: keep running and build matrices on request, sent to the Unix domain socket `socket` as lines of JSON and answered likewise. Indexes and processed alignments of the input directories (`-d` and `-r`) are kept in memory (up to `--cache-size` megabytes) between builds, and the directories are watched for changes (scanned every two seconds and before each build), so only files added or modified are read again. A request gives a root name and options as in a line of a batch manifest (`{"name": "test_m50", "options": "-m 50 -g"}`, see `-b`; options in the command line are the defaults) or a whole manifest (`{"manifest": "..."}`), and optionally the directory of the output files (`"output"`, which are replaced whole), their compression (`"compression"`), or `"render": true` to get the content of the files instead of their paths. Requests `{"command": "status"}` and `{"command": "stop"}` are also understood. From Python, `send_request(socket, request)` returns the response (paths written or matrices, execution log, warnings, and input files changed since the last build).',
+
+			'-s': 'Stream the matrix in `format` (`tnt`, `raxml`, `fasttree`, or one of the IQ-Tree partition types: `nucleic`, `peptidic`, `indel`, `morphological`, `gene_content`) to standard output, or to `path` (e.g. a named pipe made with `mkfifo`) if given, instead of writing its file, so it can be fed straight into another program. The execution log is then printed to standard error. `--stream` can be used as well.',
+
+			'-z': 'Compress the output matrices with `gzip` or `xz` (extensions `.gz` and `.xz` are added to their names). Compression and writing are done by background threads while the matrix is assembled. Partition files are not compressed, the IQ-Tree nexus file refers to the compressed matrices.',
+
 			'-r': 'Folder containing a morphological matrix or a set of ortholog duplication matrices. Datasets should be saved a .tsv tables. Multiple states (polymorphic characters) should be separated by pipes (`\|`).'
 
 			}
 	},
 
-	'Input specification': 'The program only accepts alignments in fasta format, and their file extensions should be `fa`, `fas`, or `fasta`. Alignments should also be located in a single folder, which path is parsed with the option `-d`.\n\nOther kinds of data (e.g. a morphological matrix or multiple ortholog encoding tables) can also be concatenated. The first row of each table should contain the character names, and the first column the names of the terminals. These matrices should be saved as tab-separated values: simple text tables with tabs as column separators and `tsv` extension. These tables should be located in a single directory, which is parsed with the option `-r`. Polymorphisms should be separated by pipes (`|`): `leaves_pinnate|leaves_bipinnate`. Be aware that polymorphisms are only fully supported for the TNT output, they will be encoded as missing data in the rest of output datasets.',
+	'Input specification': 'The program only accepts alignments in fasta format, and their file extensions should be `fa`, `fan`, or `fasta`. Input files (alignments and tables) can also be compressed with gzip, bzip2, or xz, in which case the extension of the compression format is added to the former (e.g. `matK.fasta.gz`, `traits.tsv.xz`). Compressed files are indexed as streams, and each alignment is decompressed into an anonymous temporary file (in the default temporary directory, see `TMPDIR`) only while it is parsed, so there is at most one such file per process at a time. Alignments should also be located in a single folder, which path is parsed with the option `-d`.\n\nOther kinds of data (e.g. a morphological matrix or multiple ortholog encoding tables) can also be concatenated. The first row of each table should contain the character names, and the first column the names of the terminals. These matrices should be saved as tab-separated values: simple text tables with tabs as column separators and `tsv` extension. These tables should be located in a single directory, which is parsed with the option `-r`. Polymorphisms should be separated by pipes (`|`): `leaves_pinnate|leaves_bipinnate`. Be aware that polymorphisms are only fully supported for the TNT output, they will be encoded as missing data in the rest of output datasets.',
 
 	'Sample input/output': 'python bad2matrix.py -d test-data/fastas -f -g -n test',
 
+	'Python API': 'The pipeline can also be run from Python with `build_matrix`, which takes lists of file paths or dictionaries of in-memory files (`{file name: content}`; alignment contents can be the FASTA text or `{terminal: sequence}` dictionaries) and the settings of the command line options as keyword arguments. Nothing is written to disk: the returned `Matrix` holds the partition table (`partitions`) and the concatenated rows (`sequences()`), and output files can be rendered as strings (`render(root_name)`) or written (`write(root_name)`). `build_matrices` takes a list of amino acid alphabets (`aa_encodings`) instead, and returns a `{code: Matrix}` dictionary; `build_batch` takes a dictionary of configurations (`{name: settings}`, as read from a manifest by `read_manifest`) and returns a `{name: Matrix}` dictionary. `plan_matrix` takes the arguments of `build_matrix` and returns the estimates of `--plan`.\n\n```python\nfrom bad2matrix import build_matrix\nmatrix = build_matrix({\'gene.fasta\': {\'sp0\': \'ACGT-A\', \'sp1\': \'ACGTTA\', \'sp2\': \'TCGT-A\', \'sp3\': \'TCGTTA\'}}, code_gene_content = False)\nprint(matrix.render(\'test\')[\'tnt_datasets/test.ss\'])\nmatrix.close()\n```',
+
 	'Citation':  'Little, D. P. & N. R. Salinas. 2023. BAD2matrix: better phylogenomic matrix concatenation, indel coding, gene content coding, reduced amino acid alphabets, and occupancy filtering. Software distributed by the authors. DOI: 10.5281/zenodo.10028408.',
 
-	'Additional files': 'Python scripts used for development.\n\n`make_readme.py`: Updates README.md file from source documentation.\n\n`sim_data.py`: Generates fasta alignments, executes BAD2matrix contatenation, and verifies gene content encoding.\n\n`test.py`: Preliminary test functions.',
+	'Additional files': 'Python scripts used for development.\n\n`benchmark.py`: Times BAD2matrix stages on synthetic datasets of configurable size and appends the results to a JSON file for comparison across commits.\n\n`make_readme.py`: Updates README.md file from source documentation.\n\n`sim_data.py`: Generates fasta alignments (also large synthetic datasets for benchmarking), executes BAD2matrix contatenation, and verifies gene content encoding.\n\n`test.py`: Preliminary test functions.',
 
 	'License': '[GPL2](https://github.com/dpl10/BAD2matrix/blob/master/LICENSE)',
 
@@ -113,6 +166,8 @@ def get_cli_help():
 
 valid_fasta_ext = ['fa', 'fasta', 'fan']
 
+aa_encoding_pattern = re.compile(r'^(2|3|4|5|6|6dso|6kgb|6sr|8|10|11|12|15|18|20)$')
+
 nucl_amb_codes = {
 	'R': ['A' , 'G'],
 	'Y': ['C' , 'T'],
@@ -180,12 +235,257 @@ pep2numb = {
 	'X': '?'
 }
 
+compressors = {'gz': gzip, 'bz2': bz2, 'xz': lzma}
+
+
+def get_compression(filename: str) -> str:
+	"""
+	Compression format of a file (`gz`, `bz2`, or `xz`) according to its 
+	extension, None if not compressed.
+	"""
+	ext = os.fspath(filename).rsplit('.', 1)[-1].lower()
+	return ext if ext in compressors else None
+
+
+def open_file(filename: str, mode: str = 'rb'):
+	"""
+	Opens a file, decompressing it on the fly if compressed.
+	"""
+	compression = get_compression(filename)
+
+	if compression is None:
+		return open(filename, mode)
+
+	return compressors[compression].open(filename, mode)
+
+
+def get_file_type(filename: str) -> str:
+	"""
+	`fasta` or `tsv` according to the file extension (compression extensions
+	aside), None if not supported.
+	"""
+	pattern = '|'.join(valid_fasta_ext)
+
+	if get_compression(filename):
+		filename = filename.rsplit('.', 1)[0]
+
+	if re.search(f'\\.({pattern})$', filename, re.I):
+		return 'fasta'
+
+	elif re.search(r'\.tsv$', filename):
+		return 'tsv'
+
+	return None
+
+
+prot_symbols = re.compile(rb'[EFILOPQJZX]')
+
+# Byte classes of molecular sequences: valid symbols are upper-cased, any 
+# other byte is mapped to `\x00`; whitespace is deleted beforehand
+fasta_blank = b' \t\n\r\v\f'
+fasta_invalid = b'\x00'
+fasta_table = bytearray(256)
+fasta_table[ord('-')] = ord('-')
+for x in b'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+	fasta_table[x] = x
+	fasta_table[x | 0x20] = x # lowercase
+fasta_table = bytes(fasta_table)
+
+
+def open_buffer(filename: str, data: bytes = None):
+	"""
+	Read-only buffer (context manager) with the content of a file: `data` 
+	itself if given, a memory map of the file otherwise. Compressed files are
+	decompressed first (`decompressed_buffer`).
+	"""
+	if data is not None:
+		return nullcontext(data)
+
+	if get_compression(filename):
+		return decompressed_buffer(filename)
+
+	if os.path.getsize(filename) == 0: # Empty files cannot be mapped
+		return nullcontext(b'')
+
+	with open(filename, 'rb') as fhandle:
+		return mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextmanager
+def decompressed_buffer(filename: str, chunk_size: int = 2 ** 20):
+	"""
+	Decompresses a file as a stream, in chunks of `chunk_size` bytes, into an
+	anonymous temporary file and yields a memory map of it. The temporary file
+	is deleted on exit.
+	"""
+	with open_file(filename, 'rb') as source, tempfile.TemporaryFile() as target:
+		shutil.copyfileobj(source, target, chunk_size)
+		target.flush()
+
+		if target.tell() == 0: # Empty files cannot be mapped
+			yield b''
+
+		else:
+			with mmap.mmap(target.fileno(), 0, access=mmap.ACCESS_READ) as fmap:
+				yield fmap
+
+
+def fasta_records(buffer) -> tuple:
+	"""
+	Yields the raw name and the byte offsets (init, end) of the sequence of 
+	each record in a FASTA `buffer` (bytes or memory map). Headers are 
+	located by searching line starts with `>`.
+	"""
+	size = len(buffer)
+	head = 0 if buffer[:1] == b'>' else buffer.find(b'\n>') + 1 or -1
+
+	while head >= 0:
+		eol = buffer.find(b'\n', head)
+		init = size if eol < 0 else eol + 1
+		nxt = -1 if eol < 0 else buffer.find(b'\n>', eol)
+		end = size if nxt < 0 else nxt + 1
+		yield (buffer[head:init].decode().lstrip('>').strip(), init, end)
+		head = end if nxt >= 0 else -1
+
+
+def stream_fasta_records(fhandle) -> tuple:
+	"""
+	As `fasta_records`, from a binary file object read line by line, along 
+	with the cleaned sequence (see `fasta_table`) of each record.
+	"""
+	pos = 0
+	record = None
+
+	for line in fhandle:
+		if line[:1] == b'>':
+			if record is not None:
+				yield (record[0], record[1], pos, b''.join(record[2]))
+			record = (line.decode().lstrip('>').strip(), pos + len(line), [])
+
+		elif record is not None:
+			record[2].append(line.translate(fasta_table, fasta_blank))
+
+		pos += len(line)
+
+	if record is not None:
+		yield (record[0], record[1], pos, b''.join(record[2]))
+
+
+def index_file(filename: str, data: bytes = None) -> dict:
+	"""
+	Reads a data file once and records its type, terminal names, byte offsets of
+	their sequences or rows, aligned length, data type, and size. `data` is read
+	as the content of the file; compressed files are read as streams.
+	"""
+	index = {'file': filename, 'file_type': get_file_type(filename), 'names': [], 
+		'offsets': [], 'length': None, 'type': None, 'data': data, 'size': None}
+	lengths = set()
+
+	if data is not None:
+		index['size'] = len(data)
+	elif index['file_type'] is not None:
+		index['size'] = os.path.getsize(filename)
+
+	if index['file_type'] == 'tsv':
+		index['type'] = 'morphological'
+
+		with (io.BytesIO(data) if data is not None else open_file(filename, 'rb')) as fhandle:
+			pos = 0
+
+			for line_num, line in enumerate(fhandle):
+				bits = re.split(r'\t', line.decode())
+
+				if line_num == 0:
+					lengths.add(len(bits) - 1)
+
+				elif bits[0]:
+					index['names'].append(bits[0])
+					index['offsets'].append((pos, pos + len(line)))
+
+				pos += len(line)
+
+	elif index['file_type'] == 'fasta':
+		index['type'] = 'nucleic'
+
+		if index['size'] > 0:
+			streamed = data is None and get_compression(filename) is not None
+
+			with (open_file(filename, 'rb') if streamed else open_buffer(filename, data)) as fmap:
+
+				if streamed:
+					records = stream_fasta_records(fmap)
+				else:
+					records = ((raw_name, init, end, fmap[init:end].translate(fasta_table, 
+						fasta_blank)) for raw_name, init, end in fasta_records(fmap))
+
+				for raw_name, init, end, thseq in records:
+					index['names'].append(raw_name)
+					index['offsets'].append((init, end))
+
+					if len(thseq) > 0:
+						lengths.add(len(thseq))
+						if prot_symbols.search(thseq):
+							index['type'] = 'peptidic'
+
+	if len(lengths) == 1:
+		index['length'] = lengths.pop()
+
+	return index
+
+
+def index_files(infiles: List[str], file_data: Dict[str, bytes] = {}, 
+	threads: int = 1) -> Dict[str, dict]:
+	"""
+	Indexes of the files (`index_file`), made by `threads` threads. Reading and
+	decompression release the interpreter lock, so compressed files are 
+	decompressed in parallel.
+	"""
+	if threads > 1 and len(infiles) > 1:
+		with ThreadPoolExecutor(threads) as pool:
+			indices = pool.map(index_file, infiles, [file_data.get(x) for x in infiles])
+			return dict(zip(infiles, indices))
+
+	return {x: index_file(x, file_data.get(x)) for x in infiles}
+
+
+def input_files(in_dir: str, in_dir_morph: str = None) -> tuple:
+	"""
+	Paths of the files in the directories of alignments (`-d`) and of tables
+	(`-r`, TSV files only).
+	"""
+	infiles = []
+	infiles_morph = []
+
+	if in_dir_morph:
+		for d, s, f in os.walk(in_dir_morph):
+			for file in f:
+				if get_file_type(file) == 'tsv':
+					infiles_morph.append(os.path.join(d,file))
+
+		if len(infiles_morph) == 0:
+			raise ValueError("Input directory (-t) does not contain any files!")
+
+	if in_dir:
+		for d, s, f in os.walk(in_dir):
+			for file in f:
+				infiles.append(os.path.join(d,file))
+
+		if len(infiles) == 0:
+			raise ValueError("Input directory (-d) does not contain any files!")
+
+	return (infiles, infiles_morph)
+
+
 def get_name_map(infiles: List[str], full_fasta_names: bool, keep: float = 1.0, 
-		 infiles_morph: List[str] = []) -> dict:
+		 infiles_morph: List[str] = [], file_index: Dict[str, dict] = None) -> dict:
 
 	name_map = {}
 	file2terms = {}
+	clean_names = {} # Terminals are usually shared among files
 	
+	if file_index is None:
+		file_index = index_files(infiles + infiles_morph)
+
 	for file in sorted(infiles + infiles_morph):
 
 		###########################    TODO    #################################
@@ -194,79 +494,85 @@ def get_name_map(infiles: List[str], full_fasta_names: bool, keep: float = 1.0,
 		# cation events. User should mention which is which through the file
 		# extension.
 		######################################################################## 
-		file_type = None
 		thname_map = {}
 		file2terms[file] = []
-		pattern = '|'.join(valid_fasta_ext)
 
-		if re.search(f'\.({pattern})$', file, re.I):
-			file_type = 'fasta'
-		elif re.search(r'\.tsv$', file):
-			file_type = 'tsv'
-		else:
+		if file_index[file]['file_type'] is None:
 			warnings.warn(f"File `{file}` skipped.")
 			continue
 
-		#print(f'{file=}, {file_type=}')
-		with open(file, 'r') as fhandle:
-
-			for line_num, line in enumerate(fhandle):
-				raw_name = None
-
-				if file_type == 'tsv' and line_num > 0:
-					bits = re.split(r'\t', line)
-					raw_name = bits[0]
-					#print(f'{raw_name=}')
+		for raw_name in file_index[file]['names']:
 
-				elif file_type == 'fasta' and line.startswith(">"):
-					line = line.lstrip('>')
-					raw_name = line.strip()
+			if raw_name: # All cleaning procedures of terminal names should be done here.
+				name = clean_names.get(raw_name)
 
-				if raw_name: # All cleaning procedures of terminal names should be done here.
+				if name is None:
 					name = raw_name
 					if not full_fasta_names: name = re.split(r'#+', name)[0]
 					name = clean_name(name)
-					#print(f'{raw_name=}, {name=}')
-					thname_map[raw_name] = name
-					file2terms[file].append(name)				
+					clean_names[raw_name] = name
+
+				#print(f'{raw_name=}, {name=}')
+				thname_map[raw_name] = name
+				file2terms[file].append(name)				
 
-			#print(f'{thname_map=}')
-			if len(set(thname_map.values())) < len(thname_map):
+		#print(f'{thname_map=}')
+		if len(set(thname_map.values())) < len(thname_map):
 
-				dup_count = {v:0 for v in thname_map.values()}
-				for k in thname_map:
-					dup_count[thname_map[k]] += 1
-				dup_count = {k:v for k,v in dup_count.items() if v > 1}
-				err = '\n'.join([k for k in thname_map if thname_map[k] in dup_count])
-				raise ValueError(f"Check the following sequence names in ´{file}´, there could be duplicates:\n{err}\n")
+			dup_count = {v:0 for v in thname_map.values()}
+			for k in thname_map:
+				dup_count[thname_map[k]] += 1
+			dup_count = {k:v for k,v in dup_count.items() if v > 1}
+			err = '\n'.join([k for k in thname_map if thname_map[k] in dup_count])
+			raise ValueError(f"Check the following sequence names in ´{file}´, there could be duplicates:\n{err}\n")
 
-			name_map.update(thname_map)
+		name_map.update(thname_map)
 
 	if keep < 1:
-		name_set = set()
+		presence = presence_index(file2terms)
+		files = list(file2terms.keys())
 
 		# Filter data files
-		file2terms = {z: file2terms[z] for z in	sorted(file2terms, reverse=True, 
-			key=lambda x: len(file2terms[x]))}
-		new_size = int(keep * len(file2terms))
-		file2terms = {x: file2terms[x] for x in list(file2terms.keys())[:new_size]}
+		ranked = sorted(range(len(files)), reverse=True, 
+			key=lambda x: len(file2terms[files[x]]))
+		new_size = int(keep * len(files))
+		kept = ranked[:new_size]
+		kept_mask = reduce(lambda x, y: x | (1 << y), kept, 0)
+		file2terms = {files[x]: file2terms[files[x]] for x in kept}
 		
-		# Update taxa names
-		for terms in file2terms.values():
-			seqs = [x for x,y in name_map.items() if y in terms]
-			name_set.update(seqs)
-
-		to_rm = []
-		for raw_name in name_map:
-			if not raw_name in name_set:
-				to_rm.append(raw_name)
-		name_map = {x:name_map[x] for x in name_map if not x in to_rm}
+		# Update taxa names: keep terminals present in any selected file
+		name_map = {x: y for x, y in name_map.items() if presence.get(y, 0) & kept_mask}
 	
 	#print(f'\n{file2terms=}\n{name_map=}\n')
 
 	return (name_map, list(file2terms.keys()))
 
 
+def presence_index(file2terms: Dict[str, List[str]]) -> Dict[str, int]:
+	"""
+	Terminal x file presence index. Returns a bitmask for each terminal name, 
+	where bit `i` is set if the terminal is present in the i-th file of 
+	`file2terms`.
+	"""
+	presence = {}
+
+	for ifile, terms in enumerate(file2terms.values()):
+		bit = 1 << ifile
+
+		for term in terms:
+			presence[term] = presence.get(term, 0) | bit
+
+	return presence
+
+
+def occupancy_distribution(presence: Dict[str, int]) -> Dict[int, int]:
+	"""
+	Number of terminals (values) present in a given number of files (keys).
+	"""
+	counts = Counter([bin(x).count('1') for x in presence.values()])
+	return {x: counts[x] for x in sorted(counts)}
+
+
 def clean_name(name:str) -> str:
 	name = re.sub(r'[\s\/\-\\#]+', '_', name) # Verify sharp replacement
 	name = re.sub(r'[^\w\._]', '', name)
@@ -359,120 +665,243 @@ def aa_redux_dict(redux_code: str) -> Dict[str, str]:
 	return trans_dict
 
 
+def ambiguity_masks(amb_codes: Dict[str, List[str]]) -> Dict[str, int]:
+	"""
+	Bitmask of every state symbol of an alphabet: standard states get one bit
+	each, ambiguity codes set the bits of the states they stand for.
+	"""
+	stand_states = sorted({x for states in amb_codes.values() for x in states})
+	masks = {x: 1 << i for i, x in enumerate(stand_states)}
+
+	for amb, states in amb_codes.items():
+		masks[amb] = reduce(lambda x, y: x | y, [masks[x] for x in states])
+
+	return masks
+
+
+state_masks = {
+	'nucleic': ambiguity_masks(nucl_amb_codes),
+	'peptidic': ambiguity_masks(prot_amb_codes)
+}
+
+stand_states = {
+	'nucleic': frozenset(x for x, y in state_masks['nucleic'].items() if y & (y - 1) == 0),
+	'peptidic': frozenset(x for x, y in state_masks['peptidic'].items() if y & (y - 1) == 0)
+}
+
+step_cache_size = 2 ** 16 # Distinct column signatures memoized by the step functions
+
+
+@lru_cache(maxsize=step_cache_size)
+def min_hitting_set(ambs: frozenset) -> int:
+	"""
+	Size of the smallest set of states that includes at least one state of 
+	every ambiguity (bitmasks), searching over the states of the narrowest.
+	"""
+	if not ambs:
+		return 0
+
+	narrowest = min(ambs, key=lambda x: bin(x).count('1'))
+	best = len(ambs)
+	bits = narrowest
+
+	while bits:
+		bit = bits & -bits
+		bits ^= bit
+		best = min(best, 1 + min_hitting_set(frozenset(x for x in ambs if not x & bit)))
+
+	return best
+
+
+@lru_cache(maxsize=step_cache_size)
+def min_steps_signature(states: tuple, char_type: str) -> int:
+	"""
+	Minimum number of steps of a molecular character, given the sorted tuple
+	of the states observed in it.
+	"""
+	masks = state_masks[char_type]
+	proj_states = 0
+	ambs = []
+
+	for state in states:
+		if state in stand_states[char_type]:
+			proj_states |= masks[state]
+		else:
+			ambs.append(masks[state])
+
+	# Ambiguities already represented in projected set
+	ambs = frozenset(x for x in ambs if not x & proj_states)
+
+	return bin(proj_states).count('1') + min_hitting_set(ambs) - 1
+
+
+@lru_cache(maxsize=step_cache_size)
+def max_steps_signature(states: tuple, char_type: str) -> tuple:
+	"""
+	Index (in `states`, sorted by decreasing frequency) of the state each
+	ambiguity is projected onto: the most frequent standard state it includes.
+	"""
+	masks = state_masks[char_type]
+	stand = [ix for ix, x in enumerate(states) if x in stand_states[char_type]]
+	targets = []
+
+	for ix, state in enumerate(states):
+		target = ix
+		if not state in stand_states[char_type]:
+			for isym in stand:
+				if masks[states[isym]] & masks[state]:
+					target = isym
+					break
+		targets.append(target)
+
+	return tuple(targets)
+
+
 def min_steps_char(count_dict, char_type):
 	
-	min_steps = None
-	
-	if char_type in ['nucleic', 'peptidic']:
-		stand_states = None
-		projector = None
-
-		if char_type == 'nucleic':
-			stand_states = ['A', 'C', 'G', 'T']
-			projector = nucl_amb_codes
-		elif char_type == 'peptidic':
-			stand_states = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 
-				'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
-			projector = prot_amb_codes
-
-		proj_states = {x for x in count_dict if x in stand_states}
-		ambs = {x for x in count_dict if not x in stand_states}
+	if char_type in state_masks:
+		return min_steps_signature(tuple(sorted(count_dict)), char_type)
+
+	return len(count_dict) - 1
+
+
+def max_steps_char(count_dict, char_type):
+
+	if len(count_dict) == 0:
+		return 0
+
+	states = tuple(sorted(count_dict, reverse=True, key=lambda y: count_dict[y]))
+	total = sum(count_dict.values())
+
+	if not char_type in state_masks:
+		return total - count_dict[states[0]]
+
+	targets = max_steps_signature(states, char_type)
+	new_count = {}
+	for state, target in zip(states, targets):
+		new_count[target] = new_count.get(target, 0) + count_dict[state]
+
+	if all(states[x] in stand_states[char_type] for x in new_count):
+		# Most frequent standard state keeps the first place, even if the 
+		# projection of ambiguities makes other states more frequent
+		return total - new_count[min(new_count)]
+
+	return total - max(new_count.values())
+
+
+internal_gaps = re.compile(r'(?<=[^-])-+(?=[^-])')
+internal_gaps_bytes = re.compile(rb'(?<=[^-])-+(?=[^-])')
+
+
+def gap_runs(seq) -> List[tuple]:
+	"""
+	(start, end) of every internal run of gaps of a sequence (str or bytes).
+	"""
+	pattern = internal_gaps if isinstance(seq, str) else internal_gaps_bytes
+	return [gap.span() for gap in pattern.finditer(seq)]
+
+
+def nested_intervals(intervals: List[tuple]) -> List[bool]:
+	"""
+	Whether each interval of a sorted list of distinct (start, end) intervals
+	contains another one, found in a single sweep from the right.
+	"""
+	out = [False] * len(intervals)
+	min_end = None
+
+	for ix in range(len(intervals) - 1, -1, -1):
+		start, end = intervals[ix]
+
+		if ix > 0 and intervals[ix - 1][0] == start:
+			out[ix] = True
+
+		elif min_end is not None and min_end <= end:
+			out[ix] = True
+
+		if min_end is None or end < min_end:
+			min_end = end
+
+	return out
+
+
+def indel_characters(indel_map: Dict[str, List[tuple]]) -> Dict[str, str]:
+	"""
+	Simple indel coding of the gap runs of each terminal. Only shared indels are
+	coded; those containing another indel are coded as `?`.
+	"""
+	indel_count = Counter(indel for indels in indel_map.values() for indel in indels)
+	indel_set = sorted([i for i in indel_count if indel_count[i] > 1])
+	indel_cols = {indel: icol for icol, indel in enumerate(indel_set)}
+	ambiguous = nested_intervals(indel_set)
+	indel_block = {}
+
+	for taxon in indel_map:
+		thcodes = bytearray(b'0' * len(indel_set))
 		
-		# Check if ambiguities are already represented in projected set
-		to_rm = []
-		for amb in ambs:
-			thset = set(projector[amb])
-			inter = proj_states & thset
-			if len(inter) > 0:
-				to_rm.append(amb)
-		ambs = {x for x in ambs if not x in to_rm}
-
-		# Check if two ambiguities have common aa/nucleotide
-		#? What if there is only one amb left?
-		l0 = 0
-		l1 = 1
-		while len(ambs) > 1 and l0 != l1:
-			l0 = len(ambs)
-			to_rm = []
-			for i,d in combinations(ambs, 2):
-				iset = set(projector[i])
-				dset = set(projector[d])
-				inter = iset & dset
-				if len(inter) > 0:
-					proj_states.update(next(iter(inter)))
-					to_rm += [i, d]
-					break
-			ambs = {x for x in ambs if not x in to_rm}
-			l1 = len(ambs)
+		for indel in indel_map[taxon]:
+			icol = indel_cols.get(indel)
+		
+			if icol is not None:
+				thcodes[icol] = ord('?') if ambiguous[icol] else ord('1')
 
-		# Just add the non-empathetic ambiguities
-		for amb in ambs:
-			proj_states.update(next(iter(amb)))
+		indel_block[taxon] = thcodes.decode()
 
-		min_steps = len(proj_states) - 1
+	return indel_block
 
-	else:
-		min_steps = len(count_dict) - 1
 
-	return min_steps
+class RunningGaps:
 
+	def __init__(self):
+		"""
+		Gap runs of a sequence read in consecutive blocks, stored flat in an array.
+		`pending` is the start of a trailing run that may still become an indel.
+		"""
+		self.runs = array('q')
+		self.started = False
+		self.pending = None
 
-def max_steps_char(count_dict, char_type):
 
-	max_steps = None
+	def add(self, seg: bytes, init: int):
+		"""
+		Adds the next block of the sequence, `init` being its first position.
+		"""
+		lead = len(seg) - len(seg.lstrip(b'-'))
 
-	if char_type in ['nucleic', 'peptidic']:
-		stand_states = None
-		projector = None
+		if lead == len(seg): # Only gaps
+			if self.started and self.pending is None:
+				self.pending = init
+			return
 
-		if char_type == 'nucleic':
-			stand_states = ['A', 'C', 'G', 'T']
-			projector = nucl_amb_codes
-		elif char_type == 'peptidic':
-			stand_states = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 
-				'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
-			projector = prot_amb_codes
+		if self.pending is not None:
+			self.runs.extend((self.pending, init + lead))
 
-		count_dict = {x: count_dict[x] for x in sorted(count_dict, reverse=True, key=lambda y: count_dict[y])}
-		new_count = {x: count_dict[x] for x in count_dict if x in stand_states} #stand_states?
-		ambs = {x: count_dict[x] for x in count_dict if not x in stand_states}
+		elif self.started and lead > 0:
+			self.runs.extend((init, init + lead))
 
-		to_rm = [0]
-		while len(to_rm) > 0:
-			to_rm = []
-			break_ext = False
-			for amb in ambs:
-				for sym in new_count:
-					if sym in projector[amb]:
-						new_count[sym] += ambs[amb]
-						to_rm.append(amb)
-						break_ext = True
-						break
-				if break_ext: break	
-			ambs = {x: ambs[x] for x in ambs if not x in to_rm}
-
-		if len(ambs) > 0:
-			new_count.update(ambs)
-			new_count = {x: new_count[x] for x in sorted(new_count, reverse=True, key=lambda y: new_count[y])}
-
-		max_steps = sum(list(new_count.values())[1:])
+		for start, end in gap_runs(seg):
+			self.runs.extend((init + start, init + end))
 
-	else:
-		count_dict = {x: count_dict[x] for x in sorted(count_dict, reverse=True, key=lambda y: count_dict[y])}
+		trail = len(seg) - len(seg.rstrip(b'-'))
+		self.pending = init + len(seg) - trail if trail else None
+		self.started = True
 
-		max_steps = sum(list(count_dict.values())[1:])
 
-	return max_steps
+	def __iter__(self):
+		return zip(self.runs[0::2], self.runs[1::2])
 
 
 class Polymorphs:
 
+	# Unicode private use areas, where polymorphism codes are taken from
+	code_ranges = [(0xE000, 0xF8FF), (0xF0000, 0xFFFFD), (0x100000, 0x10FFFD)]
+
 	def __init__(self):
 		"""
-		Simple map to keep record of TNT polymorphic encodings. 
+		Simple map to keep record of interned TNT polymorphic encodings.
 		"""
-		self.counter = 130
-		self.mapping = {}
+		self.codes = {} # polymorphism -> code
+		self.mapping = {} # code -> polymorphism
+		self.tables = {}
 
 	def add_poly_encoding(self, poly_str: str):
 		"""
@@ -481,11 +910,141 @@ class Polymorphs:
 		unicode character that will be inserted in the phylip-like, temporary 
 		storing file that the script handles in the background.
 		"""
-		thchar = chr(self.counter)
-		self.counter += 1
-		self.mapping[thchar] = poly_str
+		thchar = self.codes.get(poly_str)
+
+		if thchar is None:
+			code = len(self.codes)
+
+			for first, last in self.code_ranges:
+				if code <= last - first:
+					thchar = chr(first + code)
+					break
+				code -= last - first + 1
+
+			else:
+				raise ValueError("Too many different polymorphisms to be encoded.")
+
+			self.codes[poly_str] = thchar
+			self.mapping[thchar] = poly_str
+			self.tables = {}
+
 		return thchar
 
+	def table(self, replacement: str = None) -> dict:
+		"""
+		`str.translate` table that replaces polymorphism codes by `replacement`
+		or, if not given, by their TNT polymorphisms.
+		"""
+		if not replacement in self.tables:
+			self.tables[replacement] = {ord(x): y if replacement is None else replacement 
+				for x, y in self.mapping.items()}
+		
+		return self.tables[replacement]
+
+
+class CharMatrix(Mapping):
+
+	def __init__(self, data: Dict[str, str] = None):
+		"""
+		Taxa x columns matrix of single byte characters in one flat buffer, row
+		by row (column `j` is `buffer[j::width]`). Reads like a {taxon: sequence}
+		dictionary.
+		"""
+		self.index = {}
+		self.width = 0
+		self.buffer = bytearray()
+
+		if data:
+			for name, seq in data.items():
+				self.add_row(name, seq)
+
+
+	def add_row(self, name: str, seq):
+
+		if isinstance(seq, str):
+			seq = seq.encode('latin-1')
+
+		if len(self.index) == 0:
+			self.width = len(seq)
+
+		elif len(seq) != self.width:
+			raise ValueError(f"Row `{name}` has {len(seq)} characters, matrix width is {self.width}.")
+
+		if name in self.index:
+			raise ValueError(f"Duplicated row name in matrix: `{name}`.")
+
+		self.index[name] = len(self.index)
+		self.buffer += seq
+
+
+	def __getitem__(self, name: str) -> str:
+		return self.row(name).decode('latin-1')
+
+
+	def __iter__(self):
+		return iter(self.index)
+
+
+	def __len__(self):
+		return len(self.index)
+
+
+	def __contains__(self, name):
+		return name in self.index
+
+
+	def row(self, name: str) -> bytes:
+		irow = self.index[name]
+		return bytes(self.buffer[irow * self.width : (irow + 1) * self.width])
+
+
+	def rows(self):
+		for irow in range(len(self.index)):
+			yield bytes(self.buffer[irow * self.width : (irow + 1) * self.width])
+
+
+	def column(self, idx: int) -> bytes:
+		return bytes(self.buffer[idx::self.width]) if self.width else b''
+
+
+	def columns(self, start: int = 0, end: int = None) -> List[bytes]:
+		if end is None:
+			end = self.width
+		return [self.column(idx) for idx in range(start, end)]
+
+
+	def translate(self, table: dict):
+		"""
+		Applies a `str.maketrans` table to the whole matrix in a single pass.
+		"""
+		table = bytes(table.get(x, x) for x in range(256))
+		self.buffer = bytearray(self.buffer.translate(table))
+
+
+	def append_columns(self, block: Dict[str, str]):
+		"""
+		Appends the same number of new columns to every row. `block` maps
+		taxon names to the strings to be appended.
+		"""
+		added = None
+		new_buffer = bytearray()
+
+		for name, seq in zip(self.index, self.rows()):
+			thblock = block[name]
+			if isinstance(thblock, str):
+				thblock = thblock.encode('latin-1')
+
+			if added is None:
+				added = len(thblock)
+			elif len(thblock) != added:
+				raise ValueError("Blocks appended to a matrix should have the same length.")
+
+			new_buffer += seq
+			new_buffer += thblock
+
+		self.buffer = new_buffer
+		self.width += added or 0
+
 
 class Partition:
 
@@ -502,7 +1061,12 @@ class Partition:
 
 
 	def __init__(self, filename: str, name_map: dict, translation_dict: dict=None,
-		polymorphs: Polymorphs=None):
+		polymorphs: Polymorphs=None, columnar: bool=False, index: dict=None):
+		"""
+		Parses a FASTA alignment or a TSV table. `index` is the record of the
+		file made by `index_file` (built here if not given); FASTA sequences 
+		are read straight from their offsets, only for terminals in `name_map`.
+		"""
 
 		self.data = {}
 		self.filetype = None
@@ -519,14 +1083,19 @@ class Partition:
 		
 		#TODO######   Include name in metadata   ###########
 
-		pattern = '|'.join(valid_fasta_ext)
-		if re.search(f'\.({pattern})$', self.origin, re.I):
-			self.filetype = 'fasta'
+		if index is None:
+			index = index_file(filename)
+
+		self.filetype = index['file_type']
 
-		elif re.search(r'\.tsv$', self.origin):
-			self.filetype = 'tsv'
+		if self.filetype != 'tsv': # FASTA files are read through `open_buffer`
+			fhandle = nullcontext()
+		elif index.get('data') is None:
+			fhandle = open_file(self.origin, 'rt')
+		else: # In-memory table
+			fhandle = io.StringIO(index['data'].decode())
 
-		with open(self.origin, 'r') as fhandle:
+		with fhandle:
 			#print(f'{self.origin=}')
 			char_lens = {}
 			th_term = ''
@@ -534,41 +1103,38 @@ class Partition:
 			types = {}
 
 			if self.filetype == 'fasta':
-				
-				for line in fhandle:
-					line = line.strip()
-					#print(f'{line=}')
-					if line.startswith('>'):
 
-						if th_term and th_seq:
-							char_lens[len(th_seq)] = 0
+				if columnar:
+					self.data = CharMatrix()
 
-							if len(char_lens.keys()) > 1:
-								raise ValueError(f"Sequences in {filename} have different lengths, probably they are not aligned.")
+				if len(index['names']) > 0:
+					with open_buffer(self.origin, index.get('data')) as fmap:
 
-							th_seq = th_seq.upper()
-							thtype = self.seq_type(th_seq)
-							types[thtype] = 0
-							self.data[th_term] = th_seq
-							th_term = ''
-							th_seq = ''
+						# Slice straight the records of the selected terminals
+						for raw_name, (init, end) in zip(index['names'], index['offsets']):
 
-						th_term = name_map[line.lstrip('>')]
+							if not raw_name in name_map:
+								continue
 
-					else:
-						th_seq += line.upper()
+							th_term = name_map[raw_name]
+							th_seq = fmap[init:end].translate(fasta_table, fasta_blank)
+
+							if th_seq:
+								char_lens[len(th_seq)] = 0
+
+								if len(char_lens.keys()) > 1:
+									raise ValueError(f"Sequences in {filename} have different lengths, probably they are not aligned.")
 
-				# Capture data of last fasta entry
-				if th_term and th_seq:
-					char_lens[len(th_seq)]
+								if fasta_invalid in th_seq: # Raises the error
+									self.seq_type(''.join(fmap[init:end].decode(errors='replace').split()).upper())
 
-					if len(char_lens.keys()) > 1:
-						raise ValueError(f"Sequences in {filename} have different lengths, probably they are not aligned.")
+								thtype = 'peptidic' if prot_symbols.search(th_seq) else 'nucleic'
+								types[thtype] = 0
 
-					th_seq = th_seq.upper()
-					thtype = self.seq_type(th_seq)
-					types[thtype] = 0
-					self.data[th_term] = th_seq
+								if columnar:
+									self.data.add_row(th_term, th_seq)
+								else:
+									self.data[th_term] = th_seq.decode('latin-1')
 
 				self.metadata['states'].append(None)
 
@@ -576,6 +1142,7 @@ class Partition:
 
 				types['morphological'] = 0
 				charset = set()
+				poly_cells = 0
 				state_translations = {} # { character : { original state : new state } }
 				max_state = [] # count of states per character (starts at zero)
 
@@ -612,6 +1179,7 @@ class Partition:
 								poly += ']'
 								single_char = polymorphs.add_poly_encoding(poly)
 								th_seq += single_char
+								poly_cells += 1
 							else:
 								#print("It is not polymorphic")
 								#print(f'{char=}')
@@ -634,8 +1202,10 @@ class Partition:
 				#Checking proper state conventions
 				if '?' in charset:
 					charset.remove('?')
-								
-				self.metadata['states'].append(len(charset))
+
+				# Polymorphic cells count as states of their own
+				charset = {x for x in charset if not is_poly_code(x)}
+				self.metadata['states'].append(len(charset) + poly_cells)
 
 		#print(f'{char_lens=}')
 
@@ -658,375 +1228,2504 @@ class Partition:
 
 			raise ValueError('WTF')
 
+
 		# Peptidic state reduction
 		if translation_dict and self.metadata["type"][-1] == "peptidic":
-			for term in self.data:
-				self.data[term] = self.data[term].translate(translation_dict)
+			if isinstance(self.data, CharMatrix):
+				self.data.translate(translation_dict)
+			else:
+				for term in self.data:
+					self.data[term] = self.data[term].translate(translation_dict)
 
 
 
 	def indel_coder(self):
-		indel_map = {name:{} for name in self.data}
+		indel_block = indel_characters(self.gap_map())
+		self.add_columns(indel_block)
+		self.metadata["size"].append(len(next(iter(indel_block.values()), '')))
+		self.metadata["type"].append("indel")	
+		self.metadata["informative_chars"].append([])
+		self.metadata['states'].append(None)
+		self.metadata["origin"].append(self.origin)
 
-		# find indel morphology
-		for taxon in self.data:
-			valid_init = 0
-			valid_end = 0
-			in_gap = False
-			thgap = [None, None]
-			thindels = {}
 
-			for ichar, char in enumerate(self.data[taxon]):
-			
-				if char != '-':
-					valid_init = ichar
-					break
-			
-			for ichar, char in reversed(list(enumerate(self.data[taxon]))):
-			
-				if char != '-':
-					valid_end = ichar
-					break
-			
-			for ichar in range(valid_init, valid_end+1):
-			
-				if self.data[taxon][ichar] == '-' and not in_gap:
-					thgap[0] = ichar
-					in_gap = True
-			
-				elif self.data[taxon][ichar] != '-' and in_gap:
-					thgap[1] = ichar
-					thindels[tuple(thgap)] = 0
-					thgap = [None, None]
-					in_gap = False
-			
-			indel_map[taxon] = thindels
-		
-		#print('\nindel_map', indel_map)
+	def gap_map(self) -> Dict[str, List[tuple]]:
+		"""
+		Gap runs (indel morphology) of each terminal.
+		"""
+		if isinstance(self.data, CharMatrix):
+			return {taxon: gap_runs(seq) for taxon, seq in zip(self.data, self.data.rows())}
 
-		# count character frequency
-		indel_count = {}
-		
-		for taxon in indel_map:
+		return {taxon: gap_runs(self.data[taxon]) for taxon in self.data}
+
+
+	def add_columns(self, block: Dict[str, str]):
+		"""
+		Appends characters ({terminal: characters}) to the rows of the terminals.
+		"""
+		if isinstance(self.data, CharMatrix):
+			self.data.append_columns(block)
+		else:
+			for taxon in self.data:
+				self.data[taxon] += block[taxon]
+
+
+	def seq_type(self, sequence):
+
+		seq_type = None
+		no_valid = re.compile(r'[^ABCDEFGHIJKLMNOPQRSTUVWXYZ\-]')
+		prot = re.compile(r'[EFILOPQJZX]')
+		robj_no_valid = no_valid.search(sequence)
 		
-			for indel in indel_map[taxon]:
+		if robj_no_valid:
+			raise ValueError(f"Sequence contains a symbol not valid for molecular partition: `{robj_no_valid.group(0)}`.")
 		
-				if indel in indel_count:
-					indel_count[indel] += 1
+		elif prot.search(sequence):
+			seq_type = 'peptidic'
 		
-				else:
-					indel_count[indel] = 1
+		else:
+			seq_type = 'nucleic'
 		
-		#print('\nindel_count', indel_count)
+		return seq_type
 
-		# find ambiguity dependency among indels
-		indel_set = sorted([i for i in indel_count if indel_count[i] > 1])
-		ambiguity_map = {x:[] for x in indel_set}
-		
-		for indel in indel_set:
-		
-			for indel_ in indel_set:
-		
-				if indel != indel_:
+
+	def informative_stats(self, block_size: int = 4096, alphabets: Dict[str, dict] = None):
+		"""
+		Finds the informative characters of each subpartition, in each of the amino 
+		acid `alphabets` too if given (`metadata['alphabets']`).
+		"""
+		acc = 0
+
+		if alphabets and 'peptidic' in self.metadata['type']:
+			self.metadata['alphabets'] = {code: [[] for x in self.metadata['size']] for code in alphabets}
+		else:
+			alphabets = {}
+
+		#print(f'{self.metadata["size"]=}')
+		for sub_idx, sub_size in enumerate(self.metadata["size"]):
+			sub_type = self.metadata["type"][sub_idx]
+			#print(f'{sub_idx=}, {sub_size=}')
+			for init in range(acc, (acc + sub_size), block_size):
+				end = min(init + block_size, acc + sub_size)
+				histograms = column_histograms(get_columns(self.data, init, end))
+				informative = informative_columns(histograms, sub_type)
+				self.metadata["informative_chars"][sub_idx] += [idx + init - acc for idx in informative]
+
+				for code, translation in alphabets.items():
+					if sub_type == 'peptidic':
+						translated = [translate_histogram(x, translation) for x in histograms]
+						informative = informative_columns(translated, sub_type)
+					self.metadata['alphabets'][code][sub_idx] += [idx + init - acc for idx in informative]
+			
+			acc += sub_size
+
+		return None
+
+
+fasta_residue = re.compile(rb'[^ \t\n\r\v\f]')
+prot_symbols_any_case = re.compile(rb'[EFILOPQJZX]', re.I)
+
+
+class SpooledRows(Mapping):
+
+	def __init__(self, spool, blocks: List[int]):
+		"""
+		Rows of a partition written to `spool` (blocks `blocks`, in order), 
+		read as a {taxon: sequence} mapping.
+		"""
+		self.spool = spool
+		self.blocks = blocks
+
+
+	def __getitem__(self, name: str) -> str:
+
+		if not name in self:
+			raise KeyError(name)
+
+		return ''.join([self.spool.read(x, name) for x in self.blocks])
+
+
+	def __iter__(self):
+		return iter(self.spool.blocks[self.blocks[0]]['rows'])
+
+
+	def __len__(self):
+		return len(self.spool.blocks[self.blocks[0]]['rows'])
+
+
+	def __contains__(self, name):
+		return name in self.spool.blocks[self.blocks[0]]['rows']
+
+
+class SpooledPartition(Partition):
+
+	def __init__(self, filename: str, name_map: dict, spool, translation_dict: dict = None,
+		memory: int = 2 ** 26, index: dict = None, track_gaps: bool = True):
+		"""
+		FASTA alignment streamed into `spool` in blocks of columns of about `memory` 
+		bytes, for alignments that do not fit in memory.
+		"""
+		if index is None:
+			index = index_file(filename)
+
+		self.filetype = index['file_type']
+		self.origin = filename
+		self.spool = spool
+		self.indels = None
+		self.gaps = {}
+		self.metadata = {
+			"size": [],
+			"type": [],
+			"informative_chars": [[]],
+			"origin": [filename], 
+			"character_names": [],
+			"states" : [None]
+			}
+
+		with open_buffer(self.origin, index.get('data')) as fmap:
+			records = {} # Reading state of each sequence: byte position, end, characters read ahead
+			seq_type = 'nucleic'
+
+			for raw_name, (init, end) in zip(index['names'], index['offsets']):
+				if raw_name in name_map and fasta_residue.search(fmap, init, end):
+					records[name_map[raw_name]] = [init, end, b'']
+					if prot_symbols_any_case.search(fmap, init, end):
+						seq_type = 'peptidic'
+
+			length = index['length']
+
+			if length is None and len(records) > 0: # Checked against the others below
+				init, end, _ = next(iter(records.values()))
+				length = len(fmap[init:end].translate(None, fasta_blank))
+
+			length = length or 0
+			self.metadata['size'].append(length)
+			self.metadata['type'].append(seq_type)
+			width = max(1, memory // (4 * max(len(records), 1)))
+			iblock = spool.reserve(list(records), length)
+			self.data = SpooledRows(spool, [iblock])
+
+			if track_gaps:
+				self.gaps = {name: RunningGaps() for name in records}
+
+			for init in range(0, length, width):
+				block = CharMatrix()
+
+				for name, record in records.items():
+					block.add_row(name, self.read_columns(fmap, record, min(width, length - init)))
+
+				if translation_dict and seq_type == 'peptidic':
+					block.translate(translation_dict)
+
+				spool.write_columns(iblock, init, block.rows())
+
+				for name, seg in zip(self.gaps, block.rows()):
+					self.gaps[name].add(seg, init)
+
+				histograms = column_histograms(get_columns(block))
+				self.metadata['informative_chars'][0] += [init + x for x in informative_columns(histograms, seq_type)]
+
+			for init, end, ahead in records.values():
+				if ahead or fasta_residue.search(fmap, init, end):
+					raise ValueError(f"Sequences in {filename} have different lengths, probably they are not aligned.")
+
+
+	def read_columns(self, fmap, record: list, count: int) -> bytes:
+		"""
+		Next `count` characters of a sequence, `record` being its reading
+		state (updated).
+		"""
+		pos, end, seq = record
+
+		while len(seq) < count and pos < end:
+			stop = min(end, pos + count - len(seq) + count // 16 + 64) # Room for line breaks
+			chunk = fmap[pos:stop].translate(fasta_table, fasta_blank)
+
+			if fasta_invalid in chunk: # Raises the error
+				self.seq_type(''.join(fmap[pos:stop].decode(errors='replace').split()).upper())
+
+			seq += chunk
+			pos = stop
+
+		if len(seq) < count:
+			raise ValueError(f"Sequences in {self.origin} have different lengths, probably they are not aligned.")
+
+		record[0], record[2] = pos, seq[count:]
+
+		return seq[:count]
+
+
+	def gap_map(self) -> Dict[str, List[tuple]]:
+		gaps = self.gaps
+		self.gaps = {}
+		return gaps
+
+
+	def add_columns(self, block: Dict[str, str]):
+		self.indels = CharMatrix(block)
+		self.data.blocks.append(self.spool.add(self.indels))
+
+
+	def informative_stats(self, block_size: int = 4096, alphabets: Dict[str, dict] = None):
+		"""
+		Informative characters of the indel block; those of the sequences are
+		found while streaming.
+		"""
+		if self.indels is not None:
+			histograms = column_histograms(get_columns(self.indels))
+			self.metadata['informative_chars'][1] += informative_columns(histograms, 'indel')
+			self.indels = None
+
+
+missing_symbols = str.maketrans('', '', '-?')
+
+
+def is_poly_code(symbol: str) -> bool:
+	"""
+	Whether `symbol` is a polymorphism code.
+	"""
+	return any(first <= ord(symbol) <= last for first, last in Polymorphs.code_ranges)
+
+
+def state_counts(histogram: Counter) -> List[int]:
+	"""
+	Counts of the states of a column, every polymorphic cell a state of its own.
+	"""
+	counts = []
+
+	for state, count in histogram.items():
+		if is_poly_code(state):
+			counts += [1] * count
+		else:
+			counts.append(count)
+
+	return counts
+
+
+def get_columns(data, init: int = 0, end: int = None) -> List[str]:
+	"""
+	Returns columns `init` to `end` of a {taxon: sequence} mapping (or a
+	CharMatrix) as strings, one character per taxon in row order.
+	"""
+	if isinstance(data, CharMatrix):
+		return [col.decode('latin-1') for col in data.columns(init, end)]
+
+	columns = [''.join(col) for col in zip(*(seq[init:end] for seq in data.values()))]
+
+	if len(columns) == 0 and end is not None: # no taxa
+		columns = [''] * (end - init)
+
+	return columns
+
+
+def column_histograms(columns: List[str]) -> List[Counter]:
+	"""
+	State counts of every column, gaps and missing data aside. States keep
+	their order of first appearance, which breaks ties in `max_steps_char`.
+	"""
+	return [Counter(col.translate(missing_symbols)) for col in columns]
+
+
+def translate_histogram(histogram: Counter, translation: dict) -> Counter:
+	"""
+	State counts of a column after translating its states (e.g. to a reduced
+	amino acid alphabet). Translated states keep the order of first appearance
+	down the translated column.
+	"""
+	out = Counter()
+
+	for state, count in histogram.items():
+		out[state.translate(translation)] += count
+
+	return out
+
+
+def informative_columns(histograms: List[Counter], char_type: str) -> List[int]:
+	"""
+	Indices of the parsimony informative columns, given their state counts.
+	Only columns with ambiguity codes go through the step functions.
+	"""
+	out = []
+	stand = stand_states.get(char_type)
+
+	for idx, states in enumerate(histograms):
 		
-					if indel[0] <= indel_[0] and indel[1] >= indel_[1]:
-						ambiguity_map[indel].append(indel_)
+		if len(states) < 2:
+			continue
+
+		if stand is None:
+			counts = state_counts(states)
+			if sum(counts) - max(counts) > len(counts) - 1:
+				out.append(idx)
+
+		elif stand.issuperset(states):
+			counts = states.values()
+			if sum(counts) - max(counts) > len(states) - 1:
+				out.append(idx)
+
+		elif max_steps_char(states, char_type) > min_steps_char(states, char_type):
+			out.append(idx)
+
+	return out
+
+
+def get_informative_stats(part_sizes, part_types, part_info_chars, data_matrix):
+	acc = 0
+
+	for sub_idx, sub_size in enumerate(part_sizes):
+		histograms = column_histograms(get_columns(data_matrix, acc, (acc + sub_size)))
+		part_info_chars[sub_idx] += informative_columns(histograms, part_types[sub_idx])
+		acc += sub_size
+
+	return None
+
+
+class Spool:
+
+	def __init__(self, capacity: int = 2 ** 20, directory: str = '.'):
+		"""
+		Temporary memory-mapped file holding the data of all terminals, one 
+		partition (block) at a time; anonymous memory if `directory` is None. 
+		`blocks` records the offset, width, encoding, and rows of each block.
+		"""
+		self.capacity = max(capacity, mmap.PAGESIZE)
+		self.file = None
+		self.handle = None
+
+		if directory is None: # Anonymous memory, nothing is written to disk
+			self.map = mmap.mmap(-1, self.capacity)
+
+		else:
+			fd, self.file = tempfile.mkstemp(prefix='temporary_spool_', 
+				suffix='_do_not_delete_or_you_will_die.bin', dir=directory)
+			self.handle = os.fdopen(fd, 'w+b')
+			self.handle.truncate(self.capacity)
+			self.map = mmap.mmap(self.handle.fileno(), self.capacity)
+		self.size = 0
+		self.blocks = []
+
+
+	def add(self, data: Dict[str, str]) -> int:
+		"""
+		Writes the rows of a partition ({terminal: sequence} dict or 
+		CharMatrix) as a new block. Returns the index of the block.
+		"""
+		encoding = 'latin-1'
+		width = None
+
+		if isinstance(data, CharMatrix):
+			width = data.width
+			bffr = data.buffer
 		
-		#print('\nambiguity_map', ambiguity_map)
+		else:
+			rows = list(data.values())
+			width = len(rows[0]) if rows else 0
+
+			if any(len(x) != width for x in rows):
+				raise ValueError("Rows of a spooled partition should have the same length.")
+
+			try:
+				bffr = ''.join(rows).encode(encoding)
+			except UnicodeEncodeError:
+				encoding = 'utf-32-le'
+				bffr = ''.join(rows).encode(encoding)
+
+		self.fit(len(bffr))
+		self.map[self.size : self.size + len(bffr)] = bffr
+		self.blocks.append({
+			'offset': self.size, 
+			'width': width, 
+			'encoding': encoding, 
+			'rows': {name: irow for irow, name in enumerate(data)}
+			})
+		self.size += len(bffr)
+
+		return len(self.blocks) - 1
+
+
+	def fit(self, size: int):
+		"""
+		Grows the file until `size` more bytes fit in it.
+		"""
+		capacity = self.capacity
+
+		while self.size + size > capacity:
+			capacity *= 2
+
+		if capacity == self.capacity:
+			return
+
+		if self.file is None: # Resized anonymous maps are not backed beyond their first size
+			new_map = mmap.mmap(-1, capacity)
+			new_map[:self.size] = self.map[:self.size]
+			self.map.close()
+			self.map = new_map
+		else:
+			self.map.resize(capacity)
+
+		self.capacity = capacity
+
+
+	def reserve(self, names: List[str], width: int) -> int:
+		"""
+		Allocates a block of `width` characters (latin-1) per terminal, to be
+		filled by `write_columns`. Returns the index of the block.
+		"""
+		self.fit(width * len(names))
+		self.blocks.append({
+			'offset': self.size, 
+			'width': width, 
+			'encoding': 'latin-1', 
+			'rows': {name: irow for irow, name in enumerate(names)}
+			})
+		self.size += width * len(names)
+
+		return len(self.blocks) - 1
+
+
+	def write_columns(self, iblock: int, init: int, rows):
+		"""
+		Writes the characters of all the rows of a reserved block from column
+		`init` on.
+		"""
+		block = self.blocks[iblock]
+
+		for irow, row in enumerate(rows):
+			pos = block['offset'] + irow * block['width'] + init
+			self.map[pos : pos + len(row)] = row
+
+
+	def truncate(self, iblock: int):
+		"""
+		Drops block `iblock` and all the following ones.
+		"""
+		self.size = self.blocks[iblock]['offset']
+		del self.blocks[iblock:]
+
+
+	def read(self, iblock: int, name: str) -> str:
+		"""
+		Row of a terminal in a block, None if the terminal is absent.
+		"""
+		block = self.blocks[iblock]
+		irow = block['rows'].get(name)
+
+		if irow is None:
+			return None
+
+		bytes_per_row = block['width'] * (1 if block['encoding'] == 'latin-1' else 4)
+		init = block['offset'] + irow * bytes_per_row
+
+		return self.map[init : init + bytes_per_row].decode(block['encoding'])
+
+
+	def close(self):
+		self.map.close()
+
+		if self.handle:
+			self.handle.close()
+
+		if self.file and os.path.exists(self.file):
+			os.remove(self.file)
+
+
+def io_counters() -> tuple:
+	"""
+	Bytes read and written by the process through system calls (`rchar` and 
+	`wchar` of `/proc/self/io`; Linux only, zeros elsewhere). Reads of memory-
+	mapped files are not included.
+	"""
+	counters = {}
+
+	try:
+		with open('/proc/self/io') as fhandle:
+			for line in fhandle:
+				key, value = line.split(':')
+				counters[key] = int(value)
+
+	except (OSError, ValueError):
+		pass
+
+	return (counters.get('rchar', 0), counters.get('wchar', 0))
+
+
+def peak_rss() -> int:
+	"""
+	Peak resident set size of the process in bytes (None if not available).
+	"""
+	if resource is None:
+		return None
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler:
+
+	def __init__(self, enabled: bool = False):
+		"""
+		Accumulates wall time, CPU time, I/O bytes, and peak RSS of named pipeline 
+		stages. Does nothing unless `enabled`.
+		"""
+		self.enabled = enabled
+		self.stages = {}
+		self.running = {}
+
+
+	def start(self, name: str, count_io: bool = True):
+		"""
+		Starts timing a stage. Short, frequent stages can skip reading the I/O
+		counters (`count_io=False`) and report their bytes to `stop` instead.
+		"""
+		if self.enabled:
+			counters = io_counters() if count_io else (None, None)
+			self.running[name] = (time.perf_counter(), time.process_time(), *counters)
+
+
+	def stop(self, name: str, read: int = 0, written: int = 0):
+
+		if self.enabled:
+			wall, cpu, init_read, init_written = self.running.pop(name)
+
+			if init_read is not None:
+				end_read, end_written = io_counters()
+				read = end_read - init_read
+				written = end_written - init_written
+
+			self.merge({name: {'calls': 1, 
+				'wall': time.perf_counter() - wall, 
+				'cpu': time.process_time() - cpu, 
+				'read': read, 
+				'written': written, 
+				'peak_rss': peak_rss()}})
+
+
+	def merge(self, stages: dict):
+
+		for name, stats in stages.items():
+
+			if not name in self.stages:
+				self.stages[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'read': 0, 
+					'written': 0, 'peak_rss': None}
+
+			for key in ['calls', 'wall', 'cpu', 'read', 'written']:
+				self.stages[name][key] += stats[key]
+
+			if stats['peak_rss'] is not None:
+				self.stages[name]['peak_rss'] = max(stats['peak_rss'], 
+					self.stages[name]['peak_rss'] or 0)
+
+
+	def report(self) -> str:
+		"""
+		Table of stages for the execution log. Stages run by worker processes
+		add up the time of all workers.
+		"""
+		out = 'Profile (seconds, megabytes):\n\n'
+		out += f"{'stage':<28}{'calls':>8}{'wall':>10}{'cpu':>10}{'read':>10}{'written':>10}{'peak RSS':>10}\n"
+
+		for name, stats in self.stages.items():
+			rss = '-' if stats['peak_rss'] is None else f"{stats['peak_rss'] / 2**20:.1f}"
+			out += f"{name:<28}{stats['calls']:>8}{stats['wall']:>10.3f}{stats['cpu']:>10.3f}"
+			out += f"{stats['read'] / 2**20:>10.1f}{stats['written'] / 2**20:>10.1f}{rss:>10}\n"
+
+		return out
+
+
+def process_partition(filename: str, name_map: dict, translation_dict: dict = None, 
+	polymorphs: Polymorphs = None, code_indels: bool = True, columnar: bool = False, 
+	index: dict = None, profiler: Profiler = None, spool: Spool = None, 
+	memory: int = None, alphabets: Dict[str, dict] = None) -> Partition:
+	"""
+	Parses a data file, codes its indels (FASTA only) and finds its informative 
+	characters. FASTA files are spooled in column blocks if `memory` is given.
+	"""
+	if profiler is None:
+		profiler = Profiler()
+
+	if memory and index is None:
+		index = index_file(filename)
+
+	profiler.start('partition parse')
+
+	if memory and index['file_type'] == 'fasta':
+		partition = SpooledPartition(filename, name_map, spool, translation_dict, memory, 
+			index, code_indels)
+	else:
+		partition = Partition(filename, name_map, translation_dict, polymorphs, columnar, index)
+
+	profiler.stop('partition parse')
+
+	if code_indels and partition.filetype == 'fasta':
+		profiler.start('indel coding')
+		partition.indel_coder()
+		profiler.stop('indel coding')
+
+	profiler.start('informative stats')
+	partition.informative_stats(alphabets = alphabets)
+	profiler.stop('informative stats')
+
+	return partition
+
+
+pool_settings = {} # Arguments of process_partition shared by all files, set in each worker
+
+
+def init_pool(*settings):
+	pool_settings['settings'] = settings
+
+
+def pool_process_partition(filename: str, index: dict = None) -> tuple:
+	"""
+	Returns the processed partition and the profile of its stages.
+	"""
+	name_map, translation_dict, code_indels, columnar, profile, alphabets = pool_settings['settings']
+	profiler = Profiler(profile)
+	partition = process_partition(filename, name_map, translation_dict, None, code_indels, 
+		columnar, index, profiler, alphabets = alphabets)
+	return (partition, profiler.stages)
+
+
+cache_magic = b'B2MC'
+cache_version = 1 # Bump when processed partitions change
+
+
+class ProcessedPartition(Partition):
+
+	def __init__(self, filename: str, data: CharMatrix, metadata: dict):
+		"""
+		FASTA partition already indel-coded and with its informative characters
+		found: restored from a PartitionCache, or translated to one of several
+		amino acid alphabets (`alphabet_partition`).
+		"""
+		self.filetype = 'fasta'
+		self.origin = filename
+		self.data = data
+		self.metadata = metadata
+		self.metadata['origin'] = [filename] * len(metadata['origin'])
+
+
+def alphabet_partition(partition: Partition, code: str, translation: dict) -> Partition:
+	"""
+	Partition processed for several amino acid alphabets, as if processed 
+	for alphabet `code` alone: peptidic data translated, and informative
+	characters of that alphabet.
+	"""
+	if not 'alphabets' in partition.metadata:
+		return partition
+
+	metadata = {key: value for key, value in partition.metadata.items() if key != 'alphabets'}
+	metadata['informative_chars'] = partition.metadata['alphabets'][code]
+
+	if isinstance(partition.data, CharMatrix):
+		data = CharMatrix()
+		data.index = partition.data.index
+		data.width = partition.data.width
+		data.buffer = partition.data.buffer
+		data.translate(translation) # Indel codes are not translated
+	else:
+		data = {name: seq.translate(translation) for name, seq in partition.data.items()}
+
+	return ProcessedPartition(partition.origin, data, metadata)
+
+
+def strip_indels(partition: Partition) -> Partition:
+	"""
+	Indel-coded FASTA partition as processed without indel coding (`-i`): 
+	rows truncated to the alignment, metadata of the indel subpartition 
+	dropped.
+	"""
+	if partition.filetype != 'fasta' or len(partition.metadata['size']) < 2:
+		return partition
+
+	size = partition.metadata['size'][0]
+	metadata = {key: value if key == 'character_names' else value[:1] 
+		for key, value in partition.metadata.items() if key != 'alphabets'}
+
+	if 'alphabets' in partition.metadata:
+		metadata['alphabets'] = {code: value[:1] for code, value in partition.metadata['alphabets'].items()}
+
+	if isinstance(partition.data, CharMatrix):
+		data = CharMatrix()
+		for name, row in zip(partition.data, partition.data.rows()):
+			data.add_row(name, row[:size])
+	else:
+		data = {name: seq[:size] for name, seq in partition.data.items()}
+
+	return ProcessedPartition(partition.origin, data, metadata)
+
+
+class PartitionCache:
+
+	def __init__(self, directory: str, max_size: int = 2 ** 32):
+		"""
+		On-disk cache of processed FASTA partitions, keyed by file content and 
+		settings (`key`). Least recently used entries are evicted beyond `max_size` 
+		bytes; `hits` lists the files read from the cache.
+		"""
+		self.directory = directory
+		self.max_size = max_size
+		self.hits = []
+		os.makedirs(directory, exist_ok=True)
+		entries = [x for x in os.scandir(directory) if x.name.endswith('.b2m')]
+		entries = sorted([(x.stat().st_mtime, x.path, x.stat().st_size) for x in entries])
+		self.entries = {path: size for mtime, path, size in entries} # Least recently used first
+		self.total = sum(self.entries.values())
+
+
+	def key(self, index: dict, name_map: dict, settings: list) -> str:
+		"""
+		Hash of the content of a file (`index` as made by `index_file`), of 
+		the names given to its terminals in `name_map`, and of the `settings`
+		of the run (e.g. amino acid encoding and indel coding).
+		"""
+		digest = hashlib.sha256()
+
+		if index.get('data') is not None:
+			digest.update(index['data'])
+
+		else:
+			with open(index['file'], 'rb') as fhandle:
+				for chunk in iter(lambda: fhandle.read(2 ** 20), b''):
+					digest.update(chunk)
+
+		names = [[x, name_map.get(x)] for x in index['names']]
+		digest.update(json.dumps([cache_version, settings, names]).encode())
+
+		return digest.hexdigest()
+
+
+	def path(self, key: str) -> str:
+		return os.path.join(self.directory, f'{key}.b2m')
+
+
+	def __contains__(self, key: str):
+		return os.path.exists(self.path(key))
+
+
+	def get(self, key: str, filename: str) -> Partition:
+		"""
+		Partition of `filename` stored under `key`, None if missing or 
+		unreadable.
+		"""
+		try:
+			with open(self.path(key), 'rb') as fhandle:
+				content = fhandle.read()
+
+			if content[:4] != cache_magic:
+				return None
+
+			size = int.from_bytes(content[4:8], 'little')
+			header = json.loads(content[8 : 8 + size])
+			rows = zlib.decompress(content[8 + size:])
+			os.utime(self.path(key))
+			self.entries[self.path(key)] = self.entries.pop(self.path(key), len(content))
+
+		except (OSError, ValueError, zlib.error):
+			return None
+
+		data = CharMatrix()
+		data.width = header['width']
+		data.index = {name: irow for irow, name in enumerate(header['names'])}
+		data.buffer = bytearray(rows)
+		self.hits.append(filename)
+
+		return ProcessedPartition(filename, data, header['metadata'])
+
+
+	def put(self, key: str, partition: Partition):
+		"""
+		Stores a processed partition, then evicts old entries if needed.
+		"""
+		data = partition.data if isinstance(partition.data, CharMatrix) else CharMatrix(partition.data)
+		header = json.dumps({'names': list(data), 'width': data.width, 
+			'metadata': partition.metadata}).encode()
+		temp = f'{self.path(key)}.{os.getpid()}.tmp'
+
+		with open(temp, 'wb') as fhandle:
+			fhandle.write(cache_magic + len(header).to_bytes(4, 'little') + header)
+			fhandle.write(zlib.compress(bytes(data.buffer), 1))
+			size = fhandle.tell()
+
+		os.replace(temp, self.path(key))
+		self.total += size - self.entries.pop(self.path(key), 0)
+		self.entries[self.path(key)] = size
+		self.evict()
+
+
+	def evict(self):
+		while self.total > self.max_size and self.entries:
+			path = next(iter(self.entries))
+			self.total -= self.entries.pop(path)
+
+			if os.path.exists(path):
+				os.remove(path)
+
+
+class MemoryCache(PartitionCache):
+
+	def __init__(self, max_size: int = 2 ** 32):
+		"""
+		PartitionCache held in memory by the server, files identified by path, size,
+		and modification time. Entries of a file can be dropped at once (`forget`).
+		"""
+		self.max_size = max_size
+		self.hits = []
+		self.entries = {} # {key: (filename, partition)}, least recently used first
+		self.total = 0
+
+
+	def key(self, index: dict, name_map: dict, settings: list) -> str:
+		digest = hashlib.sha256()
+
+		if index.get('data') is not None:
+			digest.update(index['data'])
+
+		else:
+			stat = os.stat(index['file'])
+			digest.update(f"{index['file']}\t{stat.st_size}\t{stat.st_mtime_ns}".encode())
+
+		names = [[x, name_map.get(x)] for x in index['names']]
+		digest.update(json.dumps([cache_version, settings, names]).encode())
+
+		return digest.hexdigest()
+
+
+	def __contains__(self, key: str):
+		return key in self.entries
+
+
+	def get(self, key: str, filename: str) -> Partition:
+		if not key in self.entries:
+			return None
+
+		entry = self.entries.pop(key)
+		self.entries[key] = entry # Most recently used
+		data = CharMatrix()
+		data.index = entry[1].data.index
+		data.width = entry[1].data.width
+		data.buffer = entry[1].data.buffer # Never modified in place
+		self.hits.append(filename)
+
+		return ProcessedPartition(filename, data, copy.deepcopy(entry[1].metadata))
+
+
+	def put(self, key: str, partition: Partition):
+		data = partition.data if isinstance(partition.data, CharMatrix) else CharMatrix(partition.data)
+
+		if key in self.entries:
+			self.total -= len(self.entries.pop(key)[1].data.buffer)
+
+		self.entries[key] = (partition.origin, ProcessedPartition(partition.origin, data, 
+			copy.deepcopy(partition.metadata)))
+		self.total += len(data.buffer)
+		self.evict()
+
+
+	def evict(self):
+		while self.total > self.max_size and self.entries:
+			self.total -= len(self.entries.pop(next(iter(self.entries)))[1].data.buffer)
+
+
+	def forget(self, filename: str):
+		self.entries = {key: x for key, x in self.entries.items() if x[0] != filename}
+		self.total = sum([len(x[1].data.buffer) for x in self.entries.values()])
+
+
+def compile_translation(transdict: Dict[str, str]) -> dict:
+	"""
+	`str.translate` table equivalent to replacing each key of `transdict` by 
+	its value, one key after the other (i.e., a chain of `re.sub` calls): 
+	symbols produced by a replacement are rewritten by the following ones.
+	"""
+	position = {key: ix for ix, key in enumerate(transdict)}
+
+	def expand(symbol, after):
+		ix = position.get(symbol)
+		if ix is None or ix <= after:
+			return symbol
+		return ''.join([expand(x, ix) for x in transdict[symbol]])
+
+	return {ord(key): expand(key, -1) for key in transdict}
+
+
+def column_picker(indices: List[int]):
+	"""
+	Returns a function that extracts the characters at `indices` of a string.
+	"""
+	if len(indices) == 0:
+		return lambda x: ''
+
+	if len(indices) == 1:
+		return lambda x: x[indices[0] : indices[0] + 1]
+
+	getter = itemgetter(*indices)
+	return lambda x: ''.join(getter(x))
+
+
+def compile_tnt_plan(types: List[str], informative_chars: List[List[int]], 
+	polymorphs: Polymorphs = None) -> List[tuple]:
+	"""
+	Per partition (column picker, translation table) pairs used to write the TNT
+	rows of every terminal.
+	"""
+	tables = {}
+	plan = []
+
+	for thtype, thinf in zip(types, informative_chars):
+
+		if not thtype in tables:
+			transdict = {}
+
+			if thtype == 'nucleic':
+				transdict.update(nucl2numb)
+
+			elif thtype == 'peptidic':
+				transdict.update(pep2numb)
+
+			if not polymorphs is None:
+				transdict.update(polymorphs.mapping)
+
+			transdict['-'] = '?' # Just to have all missing data as '?'
+			tables[thtype] = compile_translation(transdict)
+
+		plan.append((column_picker(thinf), tables[thtype]))
+
+	return plan
+
+
+class PartitionRecord:
+	__slots__ = ('size', 'type', 'informative_chars', 'states', 'file')
+
+	def __init__(self, size: int, type: str, informative_chars: List[int], 
+		states: int = None, file: str = None):
+		self.size = size
+		self.type = type
+		self.informative_chars = informative_chars
+		self.states = states
+		self.file = file
+
+
+	def __repr__(self):
+		return f'PartitionRecord({self.size}, {self.type!r}, {len(self.informative_chars)} informative, {self.file!r})'
+
+
+class PartitionTable:
+
+	def __init__(self):
+		"""
+		Partitions of the concatenated matrix, held once for all terminals: 
+		one PartitionRecord (size, type, informative characters, number of 
+		states, and data file) per partition, in matrix order.
+		"""
+		self.records = []
+
+
+	def add(self, part: Partition):
+		"""
+		Appends the subpartitions of a processed Partition.
+		"""
+		for ipart, size in enumerate(part.metadata['size']):
+			origin = part.metadata['origin']
+			self.records.append(PartitionRecord(size, part.metadata['type'][ipart], 
+				part.metadata['informative_chars'][ipart], part.metadata['states'][ipart], 
+				origin[ipart] if ipart < len(origin) else None))
+
+
+	def add_record(self, record: PartitionRecord):
+		self.records.append(record)
+
+
+	def column(self, key: str) -> list:
+		"""
+		Values of a field (`size`, `type`, etc.) for all partitions.
+		"""
+		return [getattr(x, key) for x in self.records]
+
+
+	def rows(self) -> List[tuple]:
+		return [(x.size, x.type, x.informative_chars, x.states, x.file) for x in self.records]
+
+
+	def __len__(self):
+		return len(self.records)
+
+
+	def __getitem__(self, idx: int) -> PartitionRecord:
+		return self.records[idx]
+
+
+	def __iter__(self):
+		return iter(self.records)
+
+
+class PresenceMatrix:
+
+	def __init__(self, taxa: List[str]):
+		"""
+		Bit-packed taxa x genes presence matrix: each gene is an integer whose bit 
+		`i` is set if the i-th terminal of `taxa` has data for it.
+		"""
+		self.taxa = list(taxa)
+		self.index = {name: idx for idx, name in enumerate(self.taxa)}
+		self.genes = []
+		self.columns = []
+
+
+	def add(self, gene: str, present):
+		"""
+		Adds a gene present in the terminals listed in `present`.
+		"""
+		bits = bytearray((len(self.taxa) + 7) // 8)
+
+		for name in present:
+			idx = self.index[name]
+			bits[idx >> 3] |= 1 << (idx & 7)
+
+		self.genes.append(gene)
+		self.columns.append(int.from_bytes(bits, 'little'))
+
+
+	def gene_occupancy(self) -> List[int]:
+		"""
+		Number of terminals present in each gene.
+		"""
+		return [bin(x).count('1') for x in self.columns]
+
+
+	def taxon_occupancy(self) -> Dict[str, int]:
+		"""
+		Number of genes present in each terminal.
+		"""
+		transposed = self.transpose(self.taxa)
+		return {name: transposed.row(name).count(b'1') for name in self.taxa}
+
+
+	def transpose(self, taxa: List[str] = None) -> CharMatrix:
+		"""
+		Gene content characters ('1' present, '0' absent) of `taxa` (all by
+		default), as a CharMatrix. Genes are unpacked once to rows of the 
+		transposed matrix, whose strided columns are the rows of terminals.
+		"""
+		if taxa is None:
+			taxa = self.taxa
+
+		width = len(self.taxa)
+		genes = bytearray()
+
+		for column in self.columns: # bit i ends as the i-th character
+			genes += format(column, f'0{width}b')[::-1].encode()
+
+		out = CharMatrix()
+
+		for name in taxa:
+			idx = self.index[name]
+			out.add_row(name, bytes(genes[idx::width]) if width else b'')
+
+		return out
+
+
+	def informative(self, taxa: List[str] = None) -> List[int]:
+		"""
+		Indices of genes informative as gene content characters among `taxa`
+		(all by default): present in at least two and absent from at least
+		two of them.
+		"""
+		mask = -1
+
+		if taxa is not None:
+			mask = 0
+			for name in taxa:
+				mask |= 1 << self.index[name]
+
+		total = bin(mask).count('1') if taxa is not None else len(self.taxa)
+		counts = [bin(x & mask).count('1') for x in self.columns]
+
+		return [idx for idx, count in enumerate(counts) if count > 1 and total - count > 1]
+
+
+	def __len__(self):
+		return len(self.genes)
+
+
+class Term_data:
+	"""Simple class for aggregated DNA/AA data of a terminal"""
+	
+	def __init__(self, name: str, gene_encoding: bool = True, spool: Spool = None, 
+		table: PartitionTable = None):
+		"""
+		Partitions are those of the shared `table`, or of a table of its own fed by 
+		`feed`. `presence` has bit `i` set if the terminal is in the i-th partition.
+		"""
+		self.name = name
+		self.spool = spool
+		self.own_table = table is None
+		self.table = PartitionTable() if table is None else table
+		self.presence = 0
+		self.gene_encoding = gene_encoding
+
+
+	def feed(self, part: Partition):
+		"""
+		Records the presence of the terminal in the partition last added to 
+		the table. The data itself is written once for all terminals with 
+		`Spool.add`.
+		"""
+		tot_inf = len(reduce(lambda x, y: x + y, part.metadata["informative_chars"]))
+
+		if tot_inf > 0:
+
+			if self.own_table:
+				self.table.add(part)
+			
+			if self.name in part.data: # All subpartitions tagged as present
+				count = len(part.metadata["size"])
+				self.presence |= ((1 << count) - 1) << (len(self.table) - count)
+
+		return None
+
+
+	def present(self, ipart: int) -> bool:
+		return (self.presence >> ipart) & 1 == 1
+
+
+	def presence_flags(self) -> List[bool]:
+		"""
+		Presence of the terminal in each partition of the table.
+		"""
+		if len(self.table) == 0:
+			return []
+
+		return [x == '1' for x in reversed(format(self.presence, f'0{len(self.table)}b'))]
+
+
+	@property
+	def partition_table(self) -> List[tuple]:
+		"""
+		Size, type, informative characters, and presence of the terminal in 
+		each partition.
+		"""
+		return [(x.size, x.type, x.informative_chars, flag) for x, flag in 
+			zip(self.table, self.presence_flags())]
+
+
+	def read(self) -> str:
+		"""
+		Concatenated data of the terminal, as stored in the spool.
+		"""
+		rows = [self.spool.read(x, self.name) for x in range(len(self.spool.blocks))]
+		return ''.join([x for x in rows if x is not None])
+
+
+	def tnt_block(self, data: str, name_space: int = 20, polymorphs: Polymorphs = None, 
+		plan: List[tuple] = None) -> str:
+		"""
+		Row of the terminal in the TNT matrix, `data` being its concatenated 
+		data (as returned by `read`). `plan` is the output of 
+		`compile_tnt_plan`, built from the terminal's metadata if not given.
+		"""
+		if plan is None:
+			plan = compile_tnt_plan(self.table.column('type'), 
+				self.table.column('informative_chars'), polymorphs)
+
+		pad = name_space - len(self.name)
+		out = [self.name + " " * pad]
+		init = 0
+		end = 0
+			
+		for ipart, (part, present) in enumerate(zip(self.table, self.presence_flags())):
+
+			if present: 
+				init = end
+				end = init + part.size
+				picker, table = plan[ipart]
+				out.append(picker(data[init:end]).translate(table))
+
+			else:
+				out.append("?" * len(part.informative_chars))
+
+		out.append('\n')
+
+		return ''.join(out)
+
+
+	def phylip_block(self, data: str, name_space: int = 20, 
+		partition_type: str = 'all', polymorphs: Polymorphs = None) -> str:
+		"""
+		Row of the terminal in a phylip matrix of partitions of type 
+		`partition_type`, `data` being its concatenated data.
+		"""
+		if partition_type == 'all':
+			partition_type = ['nucleic', 'peptidic','indel', 'morphological', 'gene_content']
+		else:
+			partition_type = [partition_type]
+
+		pad = name_space - len(self.name)
+		out = [self.name + " " * pad]
+		init = 0
+		end = 0
+			
+		for part, present in zip(self.table, self.presence_flags()):
+
+			if present: 
+				init = end
+				end = init + part.size
+
+				if part.type in partition_type:
+					out.append(data[init:end].translate(polymorphs.table('?')))
+
+			else:
+				if part.type in partition_type: # write missing data
+					out.append("-" * part.size)
+
+		out.append('\n')
+
+		return ''.join(out)
+
+
+	def fasta_block(self, data: str, polymorphs: Polymorphs = None) -> str:
+		"""
+		Entry of the terminal in the FastTree matrix (molecular partitions 
+		only), `data` being its concatenated data.
+		"""
+		partition_type = ['nucleic', 'peptidic']
+		out = [f'>{self.name}\n']
+		init = 0
+		end = 0
+			
+		for part, present in zip(self.table, self.presence_flags()):
+
+			if present: 
+				init = end
+				end = init + part.size
+
+				if part.type in partition_type:
+					out.append(data[init:end].translate(polymorphs.table('-')))
+
+			else:
+				if part.type in partition_type: # write missing data
+					out.append("-" * part.size)
+
+		out.append('\n')
+
+		return ''.join(out)
+
+
+	def parse_tnt_block(self, outfile: str, name_space: int = 20, polymorphs: Polymorphs = None):
+		with open(outfile, 'a') as outhandle:
+			outhandle.write(self.tnt_block(self.read(), name_space, polymorphs))
+
+
+	def parse_phylip_block(self, outfile: str, name_space: int = 20, 
+		partition_type: str = 'all', polymorphs: Polymorphs = None):
+		with open(outfile, 'a') as ohandle:
+			ohandle.write(self.phylip_block(self.read(), name_space, partition_type, polymorphs))
+
+
+	def parse_fasta_block(self, outfile: str, polymorphs: Polymorphs = None):
+		with open(outfile, 'a') as ohandle:
+			ohandle.write(self.fasta_block(self.read(), polymorphs))
+
+
+class BackgroundWriter:
+
+	def __init__(self, fhandle, close_target: bool = True, buffer_size: int = 2 ** 20, 
+		queue_size: int = 8):
+		"""
+		Text output encoded, compressed, and written to the binary `fhandle` by a 
+		background thread, in chunks of about `buffer_size` characters. `fhandle` is
+		closed by `close` only if `close_target`.
+		"""
+		self.fhandle = fhandle
+		self.close_target = close_target
+		self.buffer_size = buffer_size
+		self.chunks = []
+		self.size = 0
+		self.error = None
+		self.queue = queue.Queue(queue_size)
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+
+	def run(self):
+
+		while True:
+			text = self.queue.get()
+
+			if text is None:
+				break
+
+			if self.error is None:
+				try:
+					self.fhandle.write(text.encode('utf-8'))
+				except Exception as err: # Raised by the main thread
+					self.error = err
+
+
+	def write(self, text: str):
+		self.chunks.append(text)
+		self.size += len(text)
+
+		if self.size >= self.buffer_size:
+			self.flush()
+
+
+	def flush(self):
+
+		if self.chunks:
+			self.queue.put(''.join(self.chunks))
+			self.chunks = []
+			self.size = 0
+
+		if self.error is not None:
+			raise self.error
+
+
+	def close(self):
+		self.flush()
+		self.queue.put(None)
+		self.thread.join()
+
+		if self.close_target:
+			self.fhandle.close()
+		else:
+			self.fhandle.flush()
+
+		if self.error is not None:
+			raise self.error
+
+
+output_compression = {'gzip': 'gz', 'xz': 'xz'} # Option value: extension
+
+
+class MatrixWriter:
+
+	def __init__(self, root_name: str, table: PartitionTable, term_number: int, 
+		name_space: int = 20, polymorphs: Polymorphs = None, profiler: Profiler = None,
+		in_memory: bool = False, compression: str = None, stream: str = None, 
+		stream_path: str = '-', directory: str = None):
+		"""
+		Writes all the concatenated matrices in a single pass over the spool. 
+		`in_memory` returns the files from `close` instead; `compression` is `gzip` 
+		or `xz`; `stream` sends one format to `stream_path` (`-` is stdout). Folders
+		are made in `directory`, or the working directory.
+		"""
+		self.profiler = Profiler() if profiler is None else profiler
+		self.name_space = name_space
+		self.polymorphs = polymorphs
+		types = table.column('type')
+		sizes = table.column('size')
+		self.tnt_plan = compile_tnt_plan(types, table.column('informative_chars'), polymorphs)
+		self.in_memory = in_memory
+		self.compression = compression
+		self.stream = stream
+		self.stream_path = stream_path
+		self.paths = {}
+		self.handles = {}
+		directory = directory or ''
+
+		if stream and not in_memory and not stream in set(types) | {'fasttree', 'raxml', 'tnt'}:
+			raise ValueError(f"Format to stream (-s) not produced by this matrix: `{stream}`!")
+
+		if not in_memory:
+			for folder in ['iqtree_datasets', 'fasttree_datasets', 'raxml_datasets', 'tnt_datasets']:
+				if not os.path.exists(os.path.join(directory, folder)):
+					os.mkdir(os.path.join(directory, folder))
+
+		# IQtree phylip files
+		for settype in set(types):
+			tot_size = sum([x for x, y in zip(sizes, types) if y == settype])
+			self.open(settype, os.path.join(directory, 'iqtree_datasets', f'{root_name}_{settype}.phy'), 'a')
+			self.handles[settype].write(f" {term_number} {tot_size} \n")
+
+		# FastTree fasta matrix
+		self.open('fasttree', os.path.join(directory, 'fasttree_datasets', f'{root_name}.fasta'), 'a')
+
+		# RAxML single phylip matrix
+		tot_size = sum(sizes)
+		self.open('raxml', os.path.join(directory, 'raxml_datasets', f'{root_name}.phy'), 'a')
+		self.handles['raxml'].write(f" {term_number} {tot_size} \n")
+
+		# TNT xread file
+		tot_size = sum([len(k.informative_chars) for k in table])
+		self.open('tnt', os.path.join(directory, 'tnt_datasets', f'{root_name}.ss'), 'w')
+		self.handles['tnt'].write(f"xread\n'File processed with BAD2matrix.'\n{tot_size} {term_number}\n")
+
+
+	def open(self, form: str, path: str, mode: str):
+
+		if self.in_memory:
+			self.handles[form] = io.StringIO()
+
+		elif form == self.stream:
+			path = self.stream_path
+			to_stdout = path == '-'
+			target = sys.stdout.buffer if to_stdout else open(path, 'wb')
+			self.handles[form] = BackgroundWriter(target, close_target = not to_stdout)
+
+		elif self.compression:
+			ext = output_compression[self.compression]
+			path = f'{path}.{ext}'
+			level = {'compresslevel': 6} if ext == 'gz' else {'preset': 3} # As `gzip -6` and `xz -3`
+			self.handles[form] = BackgroundWriter(compressors[ext].open(path, mode + 'b', **level))
+
+		else:
+			self.handles[form] = open(path, mode)
+
+		self.paths[form] = path
+
+
+	def write(self, term: Term_data):
+		self.profiler.start('spool read', False)
+		data = term.read()
+		self.profiler.stop('spool read')
+
+		for form, handle in self.handles.items():
+			label = f'{form} writer' if form in ['fasttree', 'raxml', 'tnt'] else f'iqtree {form} writer'
+			self.profiler.start(label, False)
+			
+			if form == 'fasttree':
+				block = term.fasta_block(data, polymorphs=self.polymorphs)
+			
+			elif form == 'raxml':
+				block = term.phylip_block(data, name_space=self.name_space, 
+					polymorphs=self.polymorphs)
+			
+			elif form == 'tnt':
+				block = term.tnt_block(data, name_space=self.name_space, 
+					plan=self.tnt_plan)
+			
+			else:
+				block = term.phylip_block(data, name_space=self.name_space, 
+					partition_type=form, polymorphs=self.polymorphs)
+
+			handle.write(block)
+			self.profiler.stop(label, written=len(block))
+
+
+	def close(self) -> Dict[str, str]:
+		"""
+		Closes the output files. Returns their content ({path: text}) if they
+		were written in memory, an empty dictionary otherwise.
+		"""
+		self.handles['tnt'].write(';\n')
+		texts = {}
+		self.profiler.start('output close')
+
+		for form, handle in self.handles.items():
+			if self.in_memory:
+				texts[self.paths[form]] = handle.getvalue()
+			handle.close()
+
+		self.profiler.stop('output close')
+
+		return texts
+
 
-		# remove non-informative
-		for indel in indel_count:
+def nexus_partitions(table: PartitionTable, root_name: str, suffix: str = '') -> str:
+	"""
+	IQ-Tree nexus file of the partitions (charsets refer to the phylip files
+	of each partition type, `suffix` being the extension of compression).
+	"""
+	#init = 0
+	init = {'nucleic':0, 'peptidic':0, 'indel':0, 'morphological':0, 'gene_content': 0} 
+	partinfo = "#nexus\nbegin sets;\n"
+	model_spec = "\tcharpartition mine = "
+
+	for ix, part in enumerate(table):
+		thtype = part.type
 		
-			if indel_count[indel] == 1:
+		if thtype == 'nucleic':
+			model_spec += f'GTR+I+G:part{ix+1}, '
+			
+		elif thtype == 'peptidic':
+			model_spec += f'Blosum62:part{ix+1}, '
 		
-				for taxon in indel_map:
+		elif thtype == 'indel':
+			model_spec += f'GTR2:part{ix+1}, '
+
+		elif thtype == 'morphological':
+			model_spec += f'MK:part{ix+1}, '
+						
+		elif thtype == 'gene_content':
+			model_spec += f'GTR2:part{ix+1}, '
+						
+		partinfo += f"\tcharset part{ix+1} = {root_name}_{thtype}.phy{suffix}: {init[thtype]+1}-{init[thtype] + part.size};\n"
+		init[thtype] += part.size
+
+	model_spec = model_spec.rstrip(', ')
+	partinfo += model_spec + ';\nend;\n'
+	return partinfo
+
+
+def raxml_partitions(table: PartitionTable) -> str:
+	"""
+	RAxML partition file (models and ranges of each partition).
+	"""
+	init = 0
+	partinfo = ""
+
+	for ix, part in enumerate(table):
+		thtype = part.type
 		
-					if indel in indel_map[taxon]:
-						indel_map[taxon].pop(indel)
+		if thtype == 'nucleic':
+			partinfo += 'GTR+I+G, '
+			
+		elif thtype == 'peptidic':
+			partinfo += 'Blosum62, '
 		
-		#print('\nindel_map', indel_map)
+		elif thtype == 'indel':
+			partinfo += 'BIN, '
 
-		# code characters
-		for taxon in self.data:
-			thcodes = {x:None for x in indel_set}
-			ambiguous = []
-		
-			for indel in indel_set:
-		
-				if indel in indel_map[taxon]:
-					thcodes[indel] = '1'
-		
-					if len(ambiguity_map[indel]) > 0:
-						ambiguous.append(indel)
+		elif thtype == 'morphological' or thtype == 'gene_content':
+			states = part.states
+			
+			if states == 2:
+				partinfo += 'BIN, '
+			elif states > 2:
+				partinfo += f"MULTI{states}_GTR, "
+			else:
+				raise ValueError(f"{thtype.capitalize()} partition is uninformative.")
 		
-				else:
-					thcodes[indel] = '0'
+		partinfo += f"p{ix+1} = {init+1}-{init + part.size}\n"
+		init += part.size
 
-			for amb in ambiguous:
-				thcodes[amb] = '?'
+	return partinfo
 
-			#print('\nthcodes', thcodes)
-			self.data[taxon] += ''.join(list(thcodes.values()))
 
-		self.metadata["size"].append(len(indel_set))
-		self.metadata["type"].append("indel")	
-		self.metadata["informative_chars"].append([])
-		self.metadata['states'].append(None)
-		self.metadata["origin"].append(self.origin)
+class Matrix:
+
+	def __init__(self, terminals: Dict[str, Term_data], table: PartitionTable, 
+		polymorphs: Polymorphs, spool: Spool, name_space: int = 20, files: List[str] = [], 
+		presence: Dict[str, int] = {}, profiler: Profiler = None, 
+		genes: PresenceMatrix = None, cache: PartitionCache = None):
+		"""
+		Concatenated matrix made by `build_matrix`, rows read from `spool`. Output 
+		files can be rendered in memory (`render`) or written (`write`).
+		"""
+		self.terminals = terminals
+		self.partitions = table
+		self.polymorphs = polymorphs
+		self.spool = spool
+		self.name_space = name_space
+		self.files = files
+		self.presence = presence
+		self.genes = genes
+		self.cache = cache
+		self.profiler = Profiler() if profiler is None else profiler
+
+
+	def sequences(self, partition_type: str = 'all') -> Dict[str, str]:
+		"""
+		Concatenated rows of the partitions of `partition_type` (all of them 
+		by default), as written in the phylip matrices.
+		"""
+		out = {}
 
+		for name, term in self.terminals.items():
+			row = term.phylip_block(term.read(), 0, partition_type, self.polymorphs)
+			out[name] = row[len(name) : -1]
 
-	def seq_type(self, sequence):
+		return out
+
+
+	def output(self, root_name: str, in_memory: bool, compression: str = None, 
+		stream: str = None, stream_path: str = '-', directory: str = None) -> Dict[str, str]:
+		writer = MatrixWriter(root_name, self.partitions, len(self.terminals), 
+			self.name_space, self.polymorphs, self.profiler, in_memory, compression,
+			stream, stream_path, directory)
+		directory = directory or ''
+
+		for term in self.terminals.values():
+			writer.write(term)
+
+		texts = writer.close()
+
+		self.profiler.start('partition files writer')
+		suffix = f'.{output_compression[compression]}' if compression else ''
+		texts[os.path.join(directory, 'iqtree_datasets', f'{root_name}.nex')] = nexus_partitions(
+			self.partitions, root_name, suffix)
+		texts[os.path.join(directory, 'raxml_datasets', f'{root_name}.part')] = raxml_partitions(self.partitions)
+
+		if not in_memory:
+			for path in [x for x in texts if x.endswith('.nex') or x.endswith('.part')]:
+				with open(path, 'w') as fhandle:
+					fhandle.write(texts.pop(path))
+
+		self.profiler.stop('partition files writer')
+
+		return texts
+
+
+	def render(self, root_name: str = 'matrix') -> Dict[str, str]:
+		"""
+		Content of all output files ({path: text}), without writing them.
+		"""
+		return self.output(root_name, True)
+
+
+	def write(self, root_name: str, compression: str = None, stream: str = None, 
+		stream_path: str = '-', directory: str = None):
+		"""
+		Writes all output files into their folders (see MatrixWriter). Partition 
+		files are never compressed.
+		"""
+		self.output(root_name, False, compression, stream, stream_path, directory)
+
+
+	def log(self, profile: bool = True) -> str:
+		"""
+		Body of the execution log: partitions, occupancy, and profile (unless 
+		not `profile`).
+		"""
+		out = 'Partitions processed:\n\n'
+
+		for idx, part in enumerate([x for x in self.partitions if x.file is not None]):
+			out += f'{idx+1}: {part.file}, {part.type} ({part.size} character{"s" if part.size > 1 else ""}).\n'		
+
+		out += '\nOccupancy (number of terminals present in a given number of data files):\n\n'
+
+		for files, terms in occupancy_distribution(self.presence).items():
+			out += f'{files} file{"s" if files > 1 else ""}: {terms} terminal{"s" if terms > 1 else ""}.\n'
+
+		if self.cache is not None:
+			out += f'\nPartitions read from cache: {len(self.cache.hits)}.\n'
+
+		if self.profiler.enabled and profile:
+			out += '\n' + self.profiler.report()
+
+		return out
+
+
+	def close(self):
+		self.spool.close()
+
+
+def file_content(content) -> bytes:
+	"""
+	Content of an in-memory file as bytes: text, bytes, or a {terminal: 
+	sequence} dictionary (written as FASTA).
+	"""
+	if isinstance(content, Mapping):
+		content = ''.join([f'>{name}\n{seq}\n' for name, seq in content.items()])
+
+	if isinstance(content, str):
+		content = content.encode()
+
+	return content
+
+
+class MatrixAssembler:
+
+	def __init__(self, term_names: List[str], spool: Spool, code_gene_content: bool = True, 
+		profiler: Profiler = None):
+		"""
+		Concatenates processed partitions, added in matrix order (`add`), 
+		into a Matrix (`matrix`). `build_matrices` keeps one per amino acid 
+		alphabet, each with its own spool.
+		"""
+		self.spool = spool
+		self.code_gene_content = code_gene_content
+		self.profiler = Profiler() if profiler is None else profiler
+		self.table = PartitionTable()
+		self.genes = PresenceMatrix(term_names)
+		self.spp_data = {name: Term_data(name, code_gene_content, spool, self.table) for name in term_names}
+		self.non_informative = []
+
+
+	def add(self, file: str, partition: Partition):
+		profiler = self.profiler
+		spooled = isinstance(partition.data, SpooledRows)
+		tot_inf = len(reduce(lambda x, y: x + y, partition.metadata["informative_chars"]))
+
+		if tot_inf == 0:
+			warnings.warn(f"Dataset in file {file} has no informative characters, therefore it will not be further processed and its data completelly excluded from the output files.")
+			self.non_informative.append(file)
+
+			if spooled:
+				self.spool.truncate(partition.data.blocks[0])
 
-		seq_type = None
-		no_valid = re.compile(r'[^ABCDEFGHIJKLMNOPQRSTUVWXYZ\-]')
-		prot = re.compile(r'[EFILOPQJZX]')
-		robj_no_valid = no_valid.search(sequence)
-		
-		if robj_no_valid:
-			raise ValueError(f"Sequence contains a symbol not valid for molecular partition: `{robj_no_valid.group(0)}`.")
-		
-		elif prot.search(sequence):
-			seq_type = 'peptidic'
-		
 		else:
-			seq_type = 'nucleic'
+			# Parse all data to the spool, metadata to each species
+			if not spooled:
+				profiler.start('spool write')
+				self.spool.add(partition.data)
+				profiler.stop('spool write')
+
+			profiler.start('feed')
+			self.table.add(partition)
+			for name in partition.data: # Absent terminals keep their bits unset
+				self.spp_data[name].feed(partition)
+			if partition.metadata['type'][0] in ['nucleic', 'peptidic']:
+				self.genes.add(file, partition.data)
+			profiler.stop('feed')
+
+
+	def matrix(self, act_files: List[str], code_indels: bool, polys: Polymorphs, 
+		name_space: int, presence: Dict[str, int], cache: PartitionCache = None) -> Matrix:
+		"""
+		Drops uninformative files and absent terminals, codes gene content, and
+		returns the Matrix.
+		"""
+		# remove uninformative files and spp 
+		if not code_indels:
+			act_files = [x for x in act_files if not x in self.non_informative]
+		else:
+			to_rm = []
+			for file in act_files:
+				if file in self.non_informative and f"{file}_indels" in self.non_informative:
+					to_rm.append(file)
+			act_files = [x for x in act_files if not x in to_rm]
 		
-		return seq_type
+		spp_data = {sp: self.spp_data[sp] for sp in self.spp_data if self.spp_data[sp].presence}
+		table = self.table
 
+		if self.code_gene_content:
+			self.profiler.start('gene content coding')
+			gene_block = self.genes.transpose(list(spp_data))
+			self.spool.add(gene_block)
+			table.add_record(PartitionRecord(len(self.genes), 'gene_content', 
+				self.genes.informative(list(spp_data)), 2))
+
+			for sp in spp_data: # Present in the gene content partition
+				spp_data[sp].presence |= 1 << (len(table) - 1)
+
+			self.profiler.stop('gene content coding')
+
+		return Matrix(spp_data, table, polys, self.spool, name_space = name_space,
+			files = act_files, presence = presence, profiler = self.profiler, 
+			genes = self.genes, cache = cache)
+
+
+batch_defaults = {'keep': 1.0, 'code_indels': True, 'code_gene_content': True, 'aa_encoding': '20'}
+
+
+def build_batch(infiles = [], infiles_morph = [], configs: Dict[str, dict] = {}, 
+	full_fasta_names: bool = False, columnar: bool = False, processes: int = 1, 
+	spool_dir: str = None, profiler: Profiler = None, memory: float = None, 
+	cache: PartitionCache = None, file_index: Dict[str, dict] = None) -> Dict[str, Matrix]:
+	"""
+	Concatenates alignments and tables into a Matrix per configuration of 
+	`configs` ({name: Matrix}), processing each file once for all of them. 
+	Other arguments are those of `build_matrix`.
+	"""
+	if profiler is None:
+		profiler = Profiler()
+
+	configs = {name: dict(batch_defaults, **settings) for name, settings in configs.items()}
+
+	if memory and len(configs) > 1:
+		raise ValueError("Streaming (--memory) works with a single configuration (-a, -b)!")
+
+	file_data = {}
+	for files in [infiles, infiles_morph]:
+		if isinstance(files, Mapping):
+			file_data.update({name: file_content(x) for name, x in files.items()})
+
+	infiles = list(infiles)
+	infiles_morph = list(infiles_morph)
+	aa_encodings = list(dict.fromkeys([x['aa_encoding'] for x in configs.values()]))
+	code_indels = any([x['code_indels'] for x in configs.values()])
+	alphabets = None
+	translation_dict = aa_redux_dict(aa_encodings[0])
+
+	if len(aa_encodings) > 1: # Translated after processing, see `alphabet_partition`
+		alphabets = {code: aa_redux_dict(code) for code in aa_encodings}
+		translation_dict = None
+
+	groups = {}
+	for name, settings in configs.items():
+		groups.setdefault(settings['keep'], []).append(name)
+
+	if file_index is None:
+		file_index = {}
+
+	profiler.start('file indexing')
+	missing = [x for x in infiles + infiles_morph if not x in file_index]
+	file_index.update(index_files(missing, file_data, processes))
+	profiler.stop('file indexing')
+
+	profiler.start('name mapping')
+	name_maps = {keep: get_name_map(infiles, full_fasta_names, keep, infiles_morph, 
+		file_index) for keep in sorted(groups, reverse=True)}
+	profiler.stop('name mapping')
+
+	# Largest `keep` first: its files include those of the rest
+	name_map, all_files = next(iter(name_maps.values()))
+	reused = set()
+	for keep, (thmap, act_files) in list(name_maps.items())[1:]:
+		reused.update([x for x in act_files if file_index[x]['file_type'] == 'fasta'])
+
+	store = cache
+	temporary = None
+	if reused and cache is None:
+		temporary = tempfile.mkdtemp(prefix='temporary_batch_cache_', dir=spool_dir)
+		store = PartitionCache(temporary, sys.maxsize)
+
+	pool = None
+	pending = {}
+	cache_keys = {}
+
+	if store is not None and not memory:
+		profiler.start('cache lookup')
+		settings = [aa_encodings if alphabets else aa_encodings[0], code_indels]
+
+		for file in all_files:
+			if file_index[file]['file_type'] == 'fasta' and (cache is not None or file in reused):
+				cache_keys[file] = store.key(file_index[file], name_map, settings)
+
+		profiler.stop('cache lookup')
+
+	if memory:
+		memory = max(int(memory * 2 ** 20), 1)
+
+	if processes > 1 and not memory:
+		# Tables (tsv) share polymorphism codes, they are processed serially below
+		pool_files = [x for x in all_files if file_index[x]['file_type'] != 'tsv']
+		pool = ProcessPoolExecutor(processes, initializer=init_pool, 
+			initargs=(name_map, translation_dict, code_indels, columnar, profiler.enabled, 
+			alphabets))
+		
+		pool_files = [x for x in pool_files if not (x in cache_keys and cache_keys[x] in store)]
 
-	def informative_stats(self):
-		acc = 0
-		#print(f'{self.metadata["size"]=}')
-		for sub_idx, sub_size in enumerate(self.metadata["size"]):
-			#print(f'{sub_idx=}, {sub_size=}')
-			for idx in range(acc, (acc + sub_size)):
-				states = {}
-				
-				for term in self.data:
-					pos = self.data[term][idx]
-					if not pos in ['-', '?']:
-						if pos in states:
-							states[pos] += 1
-						else:
-							states[pos] = 1
-
-				#print(f'{idx=}, {states=}, {self.metadata["type"][sub_idx]}')
-				if len(states) > 1:
-
-					min_steps = min_steps_char(states, self.metadata["type"][sub_idx])
-					max_steps = max_steps_char(states, self.metadata["type"][sub_idx])
-					#print(f"{min_steps=}, {max_steps=}")
-					
-					if max_steps > min_steps:
-						#print('idx-acc:', (idx-acc))
-						self.metadata["informative_chars"][sub_idx].append(idx-acc)
-						#print(self.metadata)
-			
-			acc += sub_size
+		for file in sorted(pool_files, key=lambda x: file_index[x]['size'], reverse=True):
+			pending[file] = pool.submit(pool_process_partition, file, file_index[file])
 
-		return None
+	matrices = {}
 
+	for keep, (thmap, act_files) in name_maps.items():
+		names = groups[keep]
+		presence = presence_index({x: [thmap[y] for y in file_index[x]['names'] 
+			if y in thmap] for x in act_files})
+		term_names = sorted(list(set(thmap.values()))) #? Why sort should be done in reverse order?
+		longest = len(max(term_names, key = len))
+		capacity = sum([file_index[x]['size'] for x in act_files])
+		assemblers = {name: MatrixAssembler(term_names, Spool(capacity, spool_dir), 
+			configs[name]['code_gene_content'], profiler) for name in names}
+		spool = assemblers[names[0]].spool # Streaming target, single configuration only
+		polys = Polymorphs()
 
-def get_informative_stats(part_sizes, part_types, part_info_chars, data_matrix):
-	acc = 0
+		for file in act_files:
+			partition = None
 
-	for sub_idx, sub_size in enumerate(part_sizes):
-		for idx in range(acc, (acc + sub_size)):
-			states = {}
-			
-			for term in data_matrix:
-				pos = data_matrix[term][idx]
-				if not pos in ['-', '?']:
-					if pos in states:
-						states[pos] += 1
-					else:
-						states[pos] = 1
-
-			if len(states) > 1:
-				min_steps = min_steps_char(states, part_types[sub_idx])
-				max_steps = max_steps_char(states, part_types[sub_idx])
-				
-				if max_steps > min_steps:
-					part_info_chars[sub_idx].append(idx-acc)
-		
-		acc += sub_size
+			if file in cache_keys and not file in pending and cache_keys[file] in store:
+				profiler.start('cache read')
+				partition = store.get(cache_keys[file], file)
+				profiler.stop('cache read')
 
-	return None
+			if partition is not None:
+				pass # Nothing to store
 
+			elif file in pending:
+				profiler.start('partition wait')
+				partition, stages = pending.pop(file).result()
+				profiler.stop('partition wait')
+				profiler.merge(stages)
+			else:
+				partition = process_partition(file, thmap, translation_dict, polys, 
+					code_indels, columnar, file_index[file], profiler, spool, memory, alphabets)
 
-class Term_data:
-	"""Simple class for aggregated DNA/AA data of a terminal"""
-	
-	def __init__(self, name: str, gene_encoding: bool):
-		self.name = name
-		self.file = "temporary_file_for_" + self.name + "_do_not_delete_or_you_will_die.txt"
-		self.metadata = {"size": [], "type": [], "informative_chars": [], "presence": []} #, "origin": []}
-		self.size = 0
-		self.gene_encoding = gene_encoding
+			if file in cache_keys and not cache_keys[file] in store:
+				profiler.start('cache write')
+				store.put(cache_keys[file], partition)
+				profiler.stop('cache write')
 
+			for name, assembler in assemblers.items():
+				settings = configs[name]
+				view = partition if settings['code_indels'] else strip_indels(partition)
+				if alphabets:
+					view = alphabet_partition(view, settings['aa_encoding'], 
+						alphabets[settings['aa_encoding']])
+				assembler.add(file, view)
 
-	def feed(self, part: Partition):
-		
-		tot_inf = len(reduce(lambda x, y: x + y, part.metadata["informative_chars"]))
+		for name, assembler in assemblers.items():
+			matrices[name] = assembler.matrix(act_files, configs[name]['code_indels'], polys, 
+				longest + 10, presence, cache)
 
-		if tot_inf > 0:
+	if pool:
+		pool.shutdown()
 
-			is_present = False
-			
-			if self.name in part.data:
-				is_present = True # All subpartitions tagged as present
-				
-				with open(self.file, 'a') as fh:
-					fh.write(part.data[self.name])
-
-			#TODO Most of the metadata (except presence) should be held globally, it is the same across partitions
-			self.metadata["size"] += part.metadata["size"]
-			self.metadata["type"] += part.metadata["type"]
-			self.metadata["informative_chars"] += part.metadata["informative_chars"]
-			#self.metadata["origin"] += part.metadata["origin"]
-			self.metadata["presence"] += [is_present for x in part.metadata["size"]]
+	if temporary:
+		shutil.rmtree(temporary)
 
-		return None
+	return {name: matrices[name] for name in configs}
 
 
-	def clean(self):
-		if os.path.exists(self.file):
-			os.remove(self.file)
-	
+def read_manifest(filename: str, defaults: dict = batch_defaults, 
+	aa_encodings: List[str] = None) -> Dict[str, dict]:
+	"""
+	Configurations of a batch manifest (`-b`), see `parse_manifest`.
+	"""
+	with open(filename) as fhandle:
+		return parse_manifest(fhandle, defaults, aa_encodings)
 
-	def parse_tnt_block(self, outfile: str, name_space: int = 20, polymorphs: Polymorphs = None):
-		#print(self.name)
-		with open(outfile, 'a') as outhandle:
-			pad = name_space - len(self.name)
-			outhandle.write(self.name + " " * pad)
-
-			with open(self.file, 'r') as inhandle:		
-
-				for data in inhandle:
-					init = 0
-					end = 0
-				
-					for ipart, isize in enumerate(self.metadata["size"]):
-
-						if self.metadata["presence"][ipart]: 
-							#print(self.metadata["informative_chars"][ipart])
-							init = end
-							end = init + isize
-							tmp = data[init:end]
-							#print(f'{len(tmp)=}')
-							tmp = [x for i,x in enumerate(list(tmp)) if i in 
-			  					self.metadata["informative_chars"][ipart]]
-							tmp = ''.join(tmp)
-							#print(f'{len(tmp)=}')
-							transdict = None
-
-							if self.metadata['type'][ipart] == 'nucleic':
-								transdict = nucl2numb
-
-							elif self.metadata['type'][ipart] == 'peptidic':
-								transdict = pep2numb
-							
-							if transdict: # Translate aaa or nucleic seq to TNT numbers
-								for mol in transdict:
-									tmp = re.sub(mol, transdict[mol], tmp)
-							
-							if not polymorphs is None:
-								for poly_symbol in polymorphs.mapping:
-									tmp = re.sub(poly_symbol, polymorphs.mapping[poly_symbol], tmp)
-
-							tmp = re.sub(r'\-', '?', tmp) # Just to have all missing data as '?' 
-							outhandle.write(tmp)
-
-						else:
-							#outhandle.write("?" * self.metadata["size"][ipart])
-							outhandle.write("?" * len(self.metadata["informative_chars"][ipart]))
-
-			outhandle.write('\n')
 
+def parse_manifest(lines: List[str], defaults: dict = batch_defaults, 
+	aa_encodings: List[str] = None) -> Dict[str, dict]:
+	"""
+	Configurations of a batch manifest, one per line: a root name followed by 
+	options `-a`, `-g`, `-i`, and `-m`. Blank and `#` lines are skipped.
+	"""
+	configs = {}
 
-	def parse_phylip_block(self, outfile: str, name_space: int = 20, 
-		partition_type: str = 'all', polymorphs: Polymorphs = None):
+	for line in lines:
+		fields = line.split()
 
-		if partition_type == 'all':
-			partition_type = ['nucleic', 'peptidic','indel', 'morphological', 'gene_content']
-		else:
-			partition_type = [partition_type]
+		if len(fields) == 0 or fields[0].startswith('#'):
+			continue
 
-		with open(outfile, 'a') as ohandle:
-			pad = name_space - len(self.name)
-			ohandle.write(self.name + " " * pad)
-
-			with open(self.file, 'r') as ihandle:
-					
-				for data in ihandle:
-					init = 0
-					end = 0
-				
-					for ipart, isize in enumerate(self.metadata["size"]):
-
-						if self.metadata["presence"][ipart]: 
-							init = end
-							end = init + isize
-
-							if self.metadata["type"][ipart] in partition_type:
-								tmp = data[init:end]
-								for poly_symbol in polymorphs.mapping:
-									tmp = re.sub(poly_symbol, '?', tmp)
-								#ohandle.write(re.sub(r'\[\w+\]', '?', data[init:end]))
-								#ohandle.write(data[init:end])
-								ohandle.write(tmp)
-
-						else:
-							if self.metadata["type"][ipart] in partition_type: # write missing data
-								ohandle.write("-" * self.metadata["size"][ipart])
-			"""
-			if self.gene_encoding:
-
-				for tipo, present in zip(self.metadata['type'], self.metadata['presence']):
-				
-					if tipo == 'nucleic' or tipo == 'peptidic':
-				
-						if present:
-							ohandle.write('X')
-						else:
-							ohandle.write('|')
-			"""
-			ohandle.write('\n')
+		settings = dict(defaults)
+		codes = aa_encodings or [defaults['aa_encoding']]
+		ifield = 1
 
+		while ifield < len(fields):
+			opt = fields[ifield]
 
+			if opt == '-g':
+				settings['code_gene_content'] = False
 
-	def parse_fasta_block(self, outfile: str, polymorphs: Polymorphs = None):
+			elif opt == '-i':
+				settings['code_indels'] = False
 
-		partition_type = ['nucleic', 'peptidic']
+			elif opt == '-a' and ifield + 1 < len(fields):
+				codes = [x for x in fields[ifield+1].split(',') if aa_encoding_pattern.search(x)]
+				if len(codes) == 0:
+					raise ValueError(f"Amino acid alphabet (-a) not recognized in batch manifest line `{line.strip()}`!")
+				codes = list(dict.fromkeys(codes))
+				ifield += 1
 
-		with open(outfile, 'a') as ohandle:
-			ohandle.write(f'>{self.name}\n')
+			elif opt == '-m' and ifield + 1 < len(fields):
+				val = int(re.sub(r'\D', '', fields[ifield+1]) or 0)
+				if not 0 < val <= 100:
+					raise ValueError(f"Percentile (-m) should be between 1 and 100 in batch manifest line `{line.strip()}`!")
+				settings['keep'] = val / 100
+				ifield += 1
+
+			else:
+				raise ValueError(f"Option `{opt}` not recognized in batch manifest line `{line.strip()}`!")
+
+			ifield += 1
+
+		for code in codes:
+			name = fields[0] if len(codes) == 1 else f'{fields[0]}_{code}'
+			if name in configs:
+				raise ValueError(f"Root name `{name}` is repeated in the batch manifest (-b)!")
+			configs[name] = dict(settings, aa_encoding = code)
+
+	if len(configs) == 0:
+		raise ValueError("Batch manifest (-b) does not contain any configuration!")
+
+	return configs
+
+
+def build_matrices(infiles = [], infiles_morph = [], full_fasta_names: bool = False, 
+	keep: float = 1.0, code_indels: bool = True, code_gene_content: bool = True, 
+	aa_encodings: List[str] = ['20'], columnar: bool = False, processes: int = 1, 
+	spool_dir: str = None, profiler: Profiler = None, memory: float = None, 
+	cache: PartitionCache = None) -> Dict[str, Matrix]:
+	"""
+	Concatenates the files into a Matrix per amino acid alphabet ({code: Matrix}),
+	processing them once (see `build_batch`).
+	"""
+	configs = {code: {'keep': keep, 'code_indels': code_indels, 'code_gene_content': 
+		code_gene_content, 'aa_encoding': code} for code in aa_encodings}
+
+	return build_batch(infiles, infiles_morph, configs, full_fasta_names, columnar, 
+		processes, spool_dir, profiler, memory, cache)
+
+
+def build_matrix(infiles = [], infiles_morph = [], full_fasta_names: bool = False, 
+	keep: float = 1.0, code_indels: bool = True, code_gene_content: bool = True, 
+	aa_encoding: str = '20', columnar: bool = False, processes: int = 1, 
+	spool_dir: str = None, profiler: Profiler = None, memory: float = None, 
+	cache: PartitionCache = None) -> Matrix:
+	"""
+	Concatenates alignments (`infiles`) and tables (`infiles_morph`), paths or 
+	in-memory files ({name: content}), into a Matrix without writing any output.
+	Other arguments follow the command line options.
+	"""
+	return build_matrices(infiles, infiles_morph, full_fasta_names, keep, code_indels, 
+		code_gene_content, [aa_encoding], columnar, processes, spool_dir, profiler, 
+		memory, cache)[aa_encoding]
+
+
+def sample_alignment(index: dict, samples: int = 256, translation_dict: dict = None, 
+	windows: int = 32, window_size: int = 256) -> dict:
+	"""
+	Cheap look at an indexed FASTA alignment for `plan_matrix`: informative and 
+	indel characters are counted in a sample of columns and scaled to the whole
+	length.
+	"""
+	length = index['length'] or 0
+	positions = sorted(set([x * length // samples for x in range(samples)])) if length else []
+	size = length if length <= windows * window_size else window_size
+	starts = [x * length // windows for x in range(windows)] if size < length else [0]
+	sampled = []
+	runs = Counter()
+
+	with open_buffer(index['file'], index['data']) as fmap:
+		for init, end in index['offsets']:
+			eol = fmap.find(b'\n', init, end)
+			eol = end if eol < 0 else eol
+			width = eol - init - (eol > init and fmap[eol - 1] == 13) # Characters per line
+			step = eol - init + 1 # Bytes per line
+			lines = -(-length // width) if width else 0
+
+			if width and size < length and end - init in [length + x * (step - width) for x in [lines, lines - 1]]:
+				# Evenly wrapped sequence, column x is at byte init + (x // width) * step + x % width
+				offset = lambda x: init + (x // width) * step + x % width
+				read = lambda x, y: fmap[offset(x) : offset(y - 1) + 1].translate(fasta_table, fasta_blank)
+				sampled.append(bytes([fmap[offset(x)] for x in positions]).translate(fasta_table).decode('latin-1'))
+
+			else:
+				row = fmap[init:end].translate(fasta_table, fasta_blank)
+				if len(row) != length:
+					continue
+				read = lambda x, y: row[x:y]
+				sampled.append(bytes([row[x] for x in positions]).decode('latin-1'))
+
+			for start in starts:
+				# Gap runs starting in the window, read on until they end
+				first = max(start - 1, 0)
+				last = start + size
+				seg = read(first, last)
+
+				while seg.endswith(b'-') and last < length:
+					seg += read(last, min(length, last + size))
+					last = min(length, last + size)
+
+				for gap in internal_gaps_bytes.finditer(seg):
+					if start <= gap.start() + first < start + size:
+						runs[(gap.start() + first, gap.end() + first)] += 1
+
+	columns = [''.join(col) for col in zip(*sampled)]
+	histograms = column_histograms(columns)
+
+	if translation_dict and index['type'] == 'peptidic':
+		histograms = [translate_histogram(x, translation_dict) for x in histograms]
+		columns = [x.translate(translation_dict) for x in columns]
+
+	informative = informative_columns(histograms, index['type'])
+	shared = [x for x in runs.values() if x > 1]
+	table = compile_translation(dict(pep2numb if index['type'] == 'peptidic' else nucl2numb, 
+		**{'-': '?'}))
+	extra = sum([len(columns[x].translate(table)) - len(columns[x]) for x in informative])
+	scale = length / len(positions) if positions else 0
+	gap_scale = length / (len(starts) * size) if length else 0
+
+	return {'taxa': len(index['names']), 'length': length, 'type': index['type'],
+		'informative': round(len(informative) * scale), 'tnt_extra': round(extra * scale),
+		'indels': round(len(shared) * gap_scale), 
+		'informative_indels': round(len([x for x in shared if x <= len(index['names']) - 2]) * gap_scale)}
+
+
+def calibration_slice(index: dict, cells: int = 2 ** 20) -> Dict[str, str]:
+	"""
+	Leading rows and columns of an indexed FASTA alignment, about `cells` 
+	characters, as a {raw name: sequence} dictionary. `plan_matrix` times 
+	their processing on this machine.
+	"""
+	length = index['length'] or 0
+	rows = min(len(index['names']), max(4, cells // max(length, 1)))
+	columns = min(length, max(cells // max(rows, 1), 1))
+	out = {}
+
+	with open_buffer(index['file'], index['data']) as fmap:
+		for name, (init, end) in zip(index['names'][:rows], index['offsets'][:rows]):
+			out[name] = fmap[init:end].translate(fasta_table, fasta_blank)[:columns].decode('latin-1')
+
+	return out
+
+
+def plan_matrix(infiles = [], infiles_morph = [], full_fasta_names: bool = False, 
+	keep: float = 1.0, code_indels: bool = True, code_gene_content: bool = True, 
+	aa_encoding: str = '20', columnar: bool = False, processes: int = 1, 
+	root_name: str = 'matrix', compression: str = None, samples: int = 256) -> dict:
+	"""
+	Estimates, without building it, the matrix of `build_matrix` (same 
+	arguments) for `--plan`: files retained, characters, and output sizes. 
+	Runtime and memory are extrapolated from a slice of the largest alignment.
+	"""
+	baseline = peak_rss() or 0
+	wall = time.perf_counter()
+	file_index = index_files(infiles + infiles_morph, {}, processes)
+	index_time = time.perf_counter() - wall
+	name_map, act_files = get_name_map(infiles, full_fasta_names, keep, infiles_morph, file_index)
+	presence = presence_index({x: [name_map[y] for y in file_index[x]['names'] 
+		if y in name_map] for x in act_files})
+	translation_dict = aa_redux_dict(aa_encoding)
+	files = {}
+
+	for file in act_files:
+		index = file_index[file]
+
+		if index['file_type'] == 'fasta':
+			files[file] = sample_alignment(index, samples, translation_dict)
+			if not code_indels:
+				files[file].update({'indels': 0, 'informative_indels': 0})
+
+		elif index['file_type'] == 'tsv':
+			files[file] = {'taxa': len(index['names']), 'length': index['length'] or 0, 
+				'type': 'morphological', 'informative': index['length'] or 0, 
+				'tnt_extra': 0, 'indels': 0, 'informative_indels': 0}
+
+	for stats in files.values(): # Left out of the matrix, see `MatrixAssembler`
+		stats['dropped'] = stats['informative'] + stats['informative_indels'] == 0
+
+	kept = [x for x in files if not files[x]['dropped']]
+	terms = sorted(set([name_map[y] for x in kept for y in file_index[x]['names'] if y in name_map]))
+	name_space = len(max(terms, key = len)) + 10 if terms else 10
+	widths = Counter()
+
+	for file in kept:
+		widths[files[file]['type']] += files[file]['length']
+		widths['indel'] += files[file]['indels']
+
+	genes = len([x for x in kept if files[x]['type'] in ['nucleic', 'peptidic']])
+	if code_gene_content:
+		widths['gene_content'] += genes
+
+	widths = {x: y for x, y in widths.items() if y > 0}
+	width = sum(widths.values())
+	informative = sum([files[x]['informative'] + files[x]['informative_indels'] for x in kept])
+	informative += genes if code_gene_content else 0
+	rows = len(terms)
+	suffix = f'.{output_compression[compression]}' if compression else ''
+	outputs = {}
+
+	for settype, size in widths.items():
+		outputs[os.path.join('iqtree_datasets', f'{root_name}_{settype}.phy{suffix}')] = \
+			len(f' {rows} {size} \n') + rows * (name_space + size + 1)
+
+	outputs[os.path.join('fasttree_datasets', f'{root_name}.fasta{suffix}')] = \
+		sum([len(x) + 3 for x in terms]) + rows * (widths.get('nucleic', 0) + widths.get('peptidic', 0))
+	outputs[os.path.join('raxml_datasets', f'{root_name}.phy{suffix}')] = \
+		len(f' {rows} {width} \n') + rows * (name_space + width + 1)
+	outputs[os.path.join('tnt_datasets', f'{root_name}.ss{suffix}')] = \
+		50 + rows * (name_space + informative + 1) + sum([files[x]['tnt_extra'] for x in kept])
+
+	# Calibration on a slice of the largest alignment
+	cells = {x: files[x]['taxa'] * (files[x]['length'] + files[x]['indels']) for x in kept 
+		if file_index[x]['file_type'] == 'fasta'}
+	sample_file = max(cells, key = lambda x: cells[x], default = None)
+	rates = {'processing': 0.0, 'writing': 0.0, 'memory': 0.0}
+
+	if sample_file is not None and file_index[sample_file]['length']:
+		data = {'calibration.fasta': calibration_slice(file_index[sample_file])}
+		profiler = Profiler(True)
+
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			tracemalloc.start()
+			build_matrix(data, [], True, 1.0, code_indels, code_gene_content, aa_encoding, 
+				columnar).close()
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			sample = build_matrix(data, [], True, 1.0, code_indels, code_gene_content, 
+				aa_encoding, columnar, profiler = profiler)
+			texts = sample.render(root_name)
+			sample.close()
+
+		sample_cells = len(data['calibration.fasta']) * sum([x.size for x in sample.partitions 
+			if x.type != 'gene_content'])
+		stages = profiler.stages
+		processing = sum([stages[x]['wall'] for x in stages if x in ['partition parse', 
+			'indel coding', 'informative stats', 'spool write', 'feed']])
+		writing = sum([stages[x]['wall'] for x in stages if x.endswith('writer') or 
+			x in ['spool read', 'output close']])
+
+		if sample_cells > 0:
+			rates['memory'] = peak / sample_cells
+			rates['processing'] = processing / sample_cells
+			rates['writing'] = writing / max(sum([len(x) for x in texts.values()]), 1)
+
+	largest = max(cells.values(), default = 0)
+	workers = min(processes, len(cells)) if processes > 1 else 1
+	output_size = sum(outputs.values())
+	spool = sum(cells.values()) + rows * widths.get('gene_content', 0) + \
+		sum([files[x]['taxa'] * files[x]['length'] for x in kept if files[x]['type'] == 'morphological'])
+
+	return {
+		'files': files,
+		'retained': len(act_files),
+		'total': len(infiles + infiles_morph),
+		'occupancy': occupancy_distribution(presence),
+		'terminals': rows,
+		'width': width,
+		'informative': informative,
+		'outputs': outputs,
+		'spool': spool,
+		'memory': round(workers * (baseline + rates['memory'] * largest) + spool), # Spool pages are resident
+		'runtime': index_time + rates['processing'] * sum(cells.values()) / workers + 
+			rates['writing'] * output_size,
+		'calibration': sample_file
+		}
+
+
+def plan_report(plan: dict) -> str:
+	"""
+	Text of the estimates of `plan_matrix`, as printed by `--plan`.
+	"""
+	megabytes = lambda x: f'{x / 2 ** 20:.1f} MB'
+	out = f"Files retained: {plan['retained']} of {plan['total']}.\n\n"
+
+	for idx, (file, stats) in enumerate(plan['files'].items()):
+		out += f"{idx+1}: {file}, {stats['type']} ({stats['taxa']} terminals, {stats['length']} characters, ~{stats['informative']} informative"
+		if stats['type'] != 'morphological':
+			out += f"; {stats['indels']} indel characters, ~{stats['informative_indels']} informative"
+		out += '), left out: no informative characters.\n' if stats['dropped'] else ').\n'
+
+	out += '\nOccupancy (number of terminals present in a given number of data files):\n\n'
+
+	for files, terms in plan['occupancy'].items():
+		out += f'{files} file{"s" if files > 1 else ""}: {terms} terminal{"s" if terms > 1 else ""}.\n'
+
+	out += f"\nMatrix: {plan['terminals']} terminals, {plan['width']} characters (~{plan['informative']} informative).\n\n"
+	out += 'Output files (uncompressed):\n\n'
+
+	for path, size in plan['outputs'].items():
+		out += f'{path}: {megabytes(size)}\n'
+
+	out += f"\nDisk: {megabytes(sum(plan['outputs'].values()) + plan['spool'])} (outputs and temporary spool of {megabytes(plan['spool'])}).\n"
+	out += f"Peak memory: ~{megabytes(plan['memory'])}.\n"
+	out += f"Runtime: ~{plan['runtime']:.2f} s"
+	out += f" (calibrated on `{plan['calibration']}`).\n" if plan['calibration'] else '.\n'
+
+	return out
+
+
+class MatrixServer:
+
+	def __init__(self, in_dir: str, in_dir_morph: str = None, defaults: dict = batch_defaults,
+		full_fasta_names: bool = False, columnar: bool = False, processes: int = 1, 
+		cache_size: int = 2 ** 32, spool_dir: str = None, profile: bool = False):
+		"""
+		Long-running matrix builder (`--serve`) keeping indexes and processed 
+		partitions of the input directories in memory between builds.
+		"""
+		self.in_dir = in_dir
+		self.in_dir_morph = in_dir_morph
+		self.defaults = defaults
+		self.full_fasta_names = full_fasta_names
+		self.columnar = columnar
+		self.processes = processes
+		self.spool_dir = spool_dir
+		self.profile = profile
+		self.cache = MemoryCache(cache_size)
+		self.file_index = {}
+		self.signatures = {}
+		self.outputs = {} # Paths written by the last build of each root name
+		self.infiles = []
+		self.infiles_morph = []
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.ready = threading.Event() # Set once the socket listens
+
+
+	def scan(self) -> List[str]:
+		"""
+		Lists the input files, drops the indexes and partitions of those 
+		changed since the last scan, and returns them.
+		"""
+		infiles, infiles_morph = input_files(self.in_dir, self.in_dir_morph)
+		signatures = {}
+
+		for file in infiles + infiles_morph:
+			stat = os.stat(file)
+			signatures[file] = (stat.st_size, stat.st_mtime_ns)
+
+		changed = sorted([x for x in set(signatures) | set(self.signatures) 
+			if signatures.get(x) != self.signatures.get(x)])
+
+		for file in changed:
+			self.file_index.pop(file, None)
+			self.cache.forget(file)
+
+		self.signatures = signatures
+		self.infiles = infiles
+		self.infiles_morph = infiles_morph
+
+		return changed
+
+
+	def watch(self, interval: float = 2.0):
+		"""
+		Scans the input directories every `interval` seconds and indexes the 
+		files changed, until the server stops.
+		"""
+		while not self.stopped.wait(interval):
+			with self.lock:
+				try:
+					self.scan()
+					missing = [x for x in self.infiles + self.infiles_morph if not x in self.file_index]
+					self.file_index.update(index_files(missing, {}, self.processes))
+				except (OSError, ValueError):
+					pass # Directories being edited, next build reports it
+
+
+	def build(self, request: dict) -> dict:
+		"""
+		Builds the matrices of a request (`name` and `options`, or `manifest`) into 
+		`output`. Returns the paths written, or the files if `render`, and the log.
+		"""
+		with self.lock, warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter('always')
+			changed = self.scan()
+
+			if 'manifest' in request:
+				lines = request['manifest'].splitlines()
+			else:
+				lines = [f"{request['name']} {request.get('options', '')}"]
+
+			configs = parse_manifest(lines, self.defaults)
+			compression = request.get('compression')
+
+			if compression is not None and not compression in output_compression:
+				raise ValueError("Output compression should be `gzip` or `xz`!")
+
+			profiler = Profiler(self.profile)
+			self.cache.hits = []
+			matrices = build_batch(self.infiles, self.infiles_morph, configs, 
+				self.full_fasta_names, self.columnar, self.processes, self.spool_dir, 
+				profiler, cache = self.cache, file_index = self.file_index)
+			response = {'status': 'ok', 'changed': changed, 'log': '', 'outputs': {}}
+
+			for idx, (name, matrix) in enumerate(matrices.items()):
+				if request.get('render'):
+					response['outputs'][name] = matrix.render(name)
+				else:
+					response['outputs'][name] = self.write(matrix, name, 
+						request.get('output', '.'), compression)
+
+				response['log'] += f'Output files `{name}`:\n\n' if len(matrices) > 1 else ''
+				response['log'] += matrix.log(profile = idx == len(matrices) - 1)
+				matrix.close()
+
+			response['warnings'] = [str(x.message) for x in caught]
+
+		return response
+
+
+	def write(self, matrix: Matrix, name: str, output: str, compression: str = None) -> List[str]:
+		"""
+		Writes the output files of `matrix` in a temporary directory and moves them 
+		into `output`, replacing those of earlier builds. Returns their paths.
+		"""
+		output = os.path.abspath(output)
+		os.makedirs(output, exist_ok=True)
+		temp = tempfile.mkdtemp(prefix='temporary_build_', dir=output)
+		paths = []
+
+		try:
+			matrix.write(name, compression, directory=temp)
+
+			for d, s, f in os.walk(temp):
+				for file in sorted(f):
+					path = os.path.join(output, os.path.relpath(os.path.join(d, file), temp))
+					os.makedirs(os.path.dirname(path), exist_ok=True)
+					os.replace(os.path.join(d, file), path)
+					paths.append(path)
+
+		finally:
+			shutil.rmtree(temp)
+
+		for path in self.outputs.get(os.path.join(output, name), []):
+			if not path in paths and os.path.exists(path):
+				os.remove(path)
+
+		self.outputs[os.path.join(output, name)] = paths
+
+		return paths
+
+
+	def handle(self, request: dict) -> dict:
+		"""
+		Answers a request: `command` is `build` (default), `status` (input
+		files and partitions held in memory), or `stop`.
+		"""
+		command = request.get('command', 'build')
+
+		try:
+			if command == 'build':
+				return self.build(request)
+
+			elif command == 'status':
+				with self.lock:
+					changed = self.scan()
+					return {'status': 'ok', 'files': len(self.infiles) + len(self.infiles_morph),
+						'changed': changed, 'indexed': len(self.file_index), 
+						'partitions': len(self.cache.entries)}
+
+			elif command == 'stop':
+				self.stopped.set()
+				return {'status': 'ok'}
+
+			raise ValueError(f"Command `{command}` not recognized!")
+
+		except Exception as err: # Reported to the client, the server keeps running
+			return {'status': 'error', 'message': f'{type(err).__name__}: {err}'}
+
+
+	def serve(self, path: str, interval: float = 2.0):
+		"""
+		Answers requests sent to the Unix socket `path` until a `stop` command.
+		Each request is a line of JSON, answered by a line of JSON (see 
+		`send_request`).
+		"""
+		if not hasattr(socketserver, 'UnixStreamServer'):
+			raise ValueError("Server mode (--serve) needs Unix domain sockets!")
+
+		server = self
+
+		class Handler(socketserver.StreamRequestHandler):
+
+			def handle(self):
+				for line in self.rfile:
+					if line.strip():
+						try:
+							response = server.handle(json.loads(line))
+						except ValueError as err:
+							response = {'status': 'error', 'message': f'Request is not JSON: {err}'}
+						self.wfile.write(json.dumps(response).encode() + b'\n')
+						self.wfile.flush()
 
-			with open(self.file, 'r') as ihandle:
-					
-				for data in ihandle:
-					init = 0
-					end = 0
-				
-					for ipart, isize in enumerate(self.metadata["size"]):
+		if os.path.exists(path):
+			os.remove(path)
 
-						if self.metadata["presence"][ipart]: 
-							init = end
-							end = init + isize
+		with self.lock:
+			self.scan()
+			self.file_index.update(index_files(self.infiles + self.infiles_morph, {}, self.processes))
 
-							if self.metadata["type"][ipart] in partition_type:
-								tmp = data[init:end]
-								for poly_symbol in polymorphs.mapping:
-									tmp = re.sub(poly_symbol, '-', tmp)
-								ohandle.write(tmp)
+		watcher = threading.Thread(target=self.watch, args=(interval,), daemon=True)
+		watcher.start()
 
-						else:
-							if self.metadata["type"][ipart] in partition_type: # write missing data
-								ohandle.write("-" * self.metadata["size"][ipart])
+		with socketserver.UnixStreamServer(path, Handler) as sockserver:
+			sockserver.timeout = 0.5
+			self.ready.set()
 
-			ohandle.write('\n')
+			try:
+				while not self.stopped.is_set():
+					sockserver.handle_request()
+			finally:
+				self.stopped.set()
+				self.ready.clear()
+				os.remove(path)
 
 
+def send_request(path: str, request: dict) -> dict:
+	"""
+	Sends a request to the server listening on the Unix socket `path` and 
+	returns its response.
+	"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(path)
+		sock.sendall(json.dumps(request).encode() + b'\n')
+		sock.shutdown(socket.SHUT_WR)
+
+		with sock.makefile('rb') as fhandle:
+			return json.loads(fhandle.readline())
 
 
 if __name__ == '__main__':
@@ -1040,7 +3739,21 @@ if __name__ == '__main__':
 	term_names = []
 	name_map = {}
 	code_indels = True
-	aa_encoding = "20"
+	aa_encodings = ["20"]
+	columnar = False
+	processes = 1
+	memory = None
+	compression = None
+	stream = None
+	stream_path = '-'
+	cache_dir = None
+	cache_size = 4096
+	batch = None
+	serve = None
+	plan = False
+	plan_file = None
+	profile = False
+	profile_file = None
 	code_gene_content = True
 	keep_percentile = 1
 	tsv_file = None
@@ -1052,8 +3765,18 @@ if __name__ == '__main__':
 	for iar,ar in enumerate(sys.argv):
 
 		if ar == '-a':
-			if re.search(r'^(2|3|4|5|6|6dso|6kgb|6sr|8|10|11|12|15|18|20)$', sys.argv[iar+1]):
-				aa_encoding = sys.argv[iar+1]
+			codes = [x for x in sys.argv[iar+1].split(',') if aa_encoding_pattern.search(x)]
+			if codes:
+				aa_encodings = list(dict.fromkeys(codes)) # Unique, in order
+
+		elif ar == '-b' or ar == '--batch':
+			if os.path.exists(sys.argv[iar+1]):
+				batch = sys.argv[iar+1]
+			else:
+				raise ValueError("Batch manifest (-b) could not be read!")
+
+		elif ar == '-c':
+			columnar = True
 
 		elif ar == '-d':
 			if os.path.exists(sys.argv[iar+1]):
@@ -1075,6 +3798,47 @@ if __name__ == '__main__':
 			if 0 < val <= 100:
 				keep_percentile = val / 100
 
+		elif ar == '-p' or ar == '--processes':
+			processes = int(re.sub(r'\D', '', sys.argv[iar+1]))
+			if processes < 1:
+				raise ValueError("Number of processes (-p) should be a positive integer!")
+
+		elif ar == '-s' or ar == '--stream':
+			stream = sys.argv[iar+1]
+			if not stream in ['tnt', 'raxml', 'fasttree', 'nucleic', 'peptidic', 'indel', 'morphological', 'gene_content']:
+				raise ValueError(f"Format to stream (-s) not recognized: `{stream}`!")
+			if iar + 2 < len(sys.argv) and not sys.argv[iar+2].startswith('-'):
+				stream_path = sys.argv[iar+2]
+
+		elif ar == '-z':
+			compression = sys.argv[iar+1]
+			if not compression in output_compression:
+				raise ValueError("Output compression (-z) should be `gzip` or `xz`!")
+
+		elif ar == '--cache':
+			cache_dir = sys.argv[iar+1]
+
+		elif ar == '--cache-size':
+			cache_size = float(sys.argv[iar+1])
+
+		elif ar == '--plan':
+			plan = True
+			if iar + 1 < len(sys.argv) and not sys.argv[iar+1].startswith('-'):
+				plan_file = sys.argv[iar+1]
+
+		elif ar == '--serve':
+			serve = sys.argv[iar+1]
+
+		elif ar == '--memory':
+			memory = float(sys.argv[iar+1])
+			if memory <= 0:
+				raise ValueError("Memory budget (--memory) should be a positive number of megabytes!")
+
+		elif ar == '--profile':
+			profile = True
+			if iar + 1 < len(sys.argv) and not sys.argv[iar+1].startswith('-'):
+				profile_file = sys.argv[iar+1]
+
 		elif ar == '-n':
 			root_name = sys.argv[iar+1]
 
@@ -1089,276 +3853,116 @@ if __name__ == '__main__':
 
 
 	# Check input directory contents
-	if in_dir_morph:
-		for d, s, f in os.walk(in_dir_morph):
-			for file in f:
-				if file.endswith('.tsv'):
-					infiles_morph.append(os.path.join(d,file))
-
-		if len(infiles_morph) == 0:
-			raise ValueError("Input directory (-t) does not contain any files!")
-
-	if in_dir:
-		for d, s, f in os.walk(in_dir):
-			for file in f:
-				infiles.append(os.path.join(d,file))
-
-		if len(infiles) == 0:
-			raise ValueError("Input directory (-d) does not contain any files!")
+	infiles, infiles_morph = input_files(in_dir, in_dir_morph)
 
+	if plan and not root_name:
+		root_name = 'matrix'
 
-	if len(infiles) > 0 and len(root_name) > 0:
+	defaults = {'keep': keep_percentile, 'code_indels': code_indels, 
+		'code_gene_content': code_gene_content, 'aa_encoding': aa_encodings[0]}
 
-		#TODO Check if output files already exist
+	if serve:
+		if not in_dir:
+			raise ValueError("Server mode (--serve) needs an input directory (-d)!")
 
-		ya = datetime.now()
-		ya = ya.strftime('%B %d, %Y - %H:%M:%S')
-		log_bffr += f'{ya}\n\nCommand arguments: '
-		log_bffr += ' '.join(sys.argv) + '\n\n'
+		server = MatrixServer(in_dir, in_dir_morph, defaults, full_fasta_names, columnar, 
+			processes, int(cache_size * 2 ** 20), '.', profile)
+		print(f'BAD2matrix serving `{in_dir}` on socket `{serve}`.', flush = True)
 
+		try:
+			server.serve(serve)
+		except KeyboardInterrupt:
+			pass
 
-		translation_dict = aa_redux_dict(aa_encoding)
-		fasttree_main = os.path.join('fasttree_datasets', f'{root_name}.fasta')
-		raxml_main = os.path.join('raxml_datasets', f'{root_name}.phy')
-		raxml_part = os.path.join('raxml_datasets', f'{root_name}.part')
-		iqtree_nexus = os.path.join('iqtree_datasets', f'{root_name}.nex')
-		tnt_main = os.path.join('tnt_datasets', f'{root_name}.ss')
-		(name_map, act_files) = get_name_map(infiles, full_fasta_names, keep_percentile, infiles_morph)
-		term_names = sorted(list(set(name_map.values()))) #? Why sort should be done in reverse order?
-		longest = len(max(term_names, key = len))
-		spp_data = {name: Term_data(name, code_gene_content) for name in term_names}
-		non_informative_partitions = []
-		final_spp_count = 0
-		part_collection = {'size': [], 'type': [], 'states': [], 'informative_chars': [], 'file': []}
-		polys = Polymorphs()
+		exit()
 
-		for file in act_files:
+	if batch:
+		configs = read_manifest(batch, defaults, aa_encodings)
+	else:
+		configs = {root_name if len(aa_encodings) == 1 else f'{root_name}_{code}': 
+			dict(defaults, aa_encoding = code) for code in aa_encodings}
 
-			partition = Partition(file, name_map, translation_dict, polys)
+	if stream and len(configs) > 1:
+		raise ValueError("Only one matrix can be streamed (-s), check options -a and -b!")
 
-			if code_indels and partition.filetype == 'fasta':
-				partition.indel_coder()
+	if plan and len(infiles) > 0:
+		plans = {}
+		plan_bffr = '\n\nBAD2matrix plan (estimates, nothing is written)\n\n'
 
-			partition.informative_stats()
-			tot_inf = len(reduce(lambda x, y: x + y, partition.metadata["informative_chars"]))
+		for name, settings in configs.items():
+			plans[name] = plan_matrix(infiles, infiles_morph, full_fasta_names, settings['keep'], 
+				settings['code_indels'], settings['code_gene_content'], settings['aa_encoding'], 
+				columnar, processes, name, compression)
 
-			if tot_inf == 0:
-				warnings.warn(f"Dataset in file {file} has no informative characters, therefore it will not be further processed and its data completelly excluded from the output files.")
-				non_informative_partitions.append(file)
+		for idx, (name, thplan) in enumerate(plans.items()):
+			plan_bffr += f'Output files `{name}`:\n\n' if len(plans) > 1 else ''
+			plan_bffr += plan_report(thplan) + ('\n' if idx < len(plans) - 1 else '')
 
-			else:
-				# Parse all data to each species file		
-				for name in spp_data:
-					spp_data[name].feed(partition)
+		if plan_file:
+			with open(plan_file, 'w') as fhandle:
+				json.dump(plans, fhandle, indent = 1)
 
-				part_collection['size'] += partition.metadata['size']
-				part_collection['type'] += partition.metadata['type']
-				part_collection['states'] += partition.metadata['states']
-				part_collection['informative_chars'] += partition.metadata['informative_chars']
-				part_collection['file'] += partition.metadata['origin']
+		print(plan_bffr)
+		exit()
 
 
-		# remove uninformative files and spp 
-		if not code_indels:
-			act_files = [x for x in act_files if not x in non_informative_partitions]
-		else:
-			to_rm = []
-			for file in act_files:
-				if file in non_informative_partitions and f"{file}_indels" in non_informative_partitions:
-					to_rm.append(file)
-			act_files = [x for x in act_files if not x in to_rm]
-		
-		spp_data = {sp: spp_data[sp] for sp in spp_data if 
-					len([x for x in spp_data[sp].metadata["presence"] if x]) > 0}
-		
-		#for sp in spp_data:
-		#	print(sp, spp_data[sp].metadata['type'], spp_data[sp].metadata['presence'])
-
-		if code_gene_content:
-			gene_number = 0
-			inf_chars = []
-			state_counts = {}
-
-			for isp, sp in enumerate(spp_data):
-				counter = 0
-
-				with open (spp_data[sp].file, 'a') as fhandle:
-					for tipo, present in zip(spp_data[sp].metadata['type'], spp_data[sp].metadata['presence']):
-						if tipo == 'nucleic' or tipo == 'peptidic':
-							
-							if isp == 0:
-								state_counts[counter] = {0:0, 1:0}
-
-							if present:
-								fhandle.write('1')
-								state_counts[counter][1] += 1
-							
-							else:
-								fhandle.write('0')
-								state_counts[counter][0] += 1
-
-							if isp == 0:
-								gene_number += 1
-							
-							counter += 1
-				
-				spp_data[sp].metadata['type'].append('gene_content')
-				spp_data[sp].metadata['size'].append(gene_number)			
-				spp_data[sp].metadata["informative_chars"].append(inf_chars) # Dummy value
-				spp_data[sp].metadata["presence"].append(True)
-
-			for char in state_counts:
-				#print(f'{char=} - {state_counts[char]=}')
-				if min(list(state_counts[char].values())) > 1: # informative
-					inf_chars.append(char)
-
-			part_collection['size'].append(gene_number)
-			part_collection['type'].append('gene_content')
-			part_collection['states'].append(2)
-			part_collection['informative_chars'].append(inf_chars)
-
-		#for spe in spp_data:
-		#	print(f'{spp_data[spe].metadata=}')
-
-		#print(f'{part_collection=}')
-
-		if not os.path.exists('iqtree_datasets'):
-			os.mkdir('iqtree_datasets')
-
-		# Write IQtree phylip files
-		iqtree_sets = set(part_collection['type'])
-
-		for settype in iqtree_sets:
-
-			thfile = f'iqtree_datasets/{root_name}_{settype}.phy'
-			th_sizes = [part_collection['size'][d] for d in range(len(part_collection['size'])) 
-					if part_collection['type'][d] == settype]
-			tot_size = sum(th_sizes)
-			
-			header = f" {len(spp_data)} {tot_size} \n"
-			with open(thfile, "a") as oh:
-				oh.write(header)
-			for sp in spp_data:
-				spp_data[sp].parse_phylip_block(thfile, name_space = (longest + 10), 
-					partition_type=settype, polymorphs=polys)
-				
-		
+	if len(infiles) > 0 and (len(root_name) > 0 or batch):
 
-		# Write IQtree nexus file
-		with open(iqtree_nexus, 'w') as iqhandle:
-			#init = 0
-			init = {'nucleic':0, 'peptidic':0, 'indel':0, 'morphological':0, 'gene_content': 0} 
-			partinfo = "#nexus\nbegin sets;\n"
-			model_spec = "\tcharpartition mine = "
-
-			for ix, thtype in enumerate(part_collection['type']):
-				
-				if thtype == 'nucleic':
-					model_spec += f'GTR+I+G:part{ix+1}, '
-					
-				elif thtype == 'peptidic':
-					model_spec += f'Blosum62:part{ix+1}, '
-				
-				elif thtype == 'indel':
-					model_spec += f'GTR2:part{ix+1}, '
-
-				elif thtype == 'morphological':
-					model_spec += f'MK:part{ix+1}, '
-								
-				elif thtype == 'gene_content':
-					model_spec += f'GTR2:part{ix+1}, '
-								
-				partinfo += f"\tcharset part{ix+1} = {root_name}_{thtype}.phy: {init[thtype]+1}-{init[thtype] + part_collection['size'][ix]};\n"
-				init[thtype] += part_collection['size'][ix]
-
-			model_spec = model_spec.rstrip(', ')
-			partinfo += model_spec + ';\nend;\n'
-			iqhandle.write(partinfo)
-
-
-		# Write FastTree fasta matrix
-		if not os.path.exists('fasttree_datasets'):
-			os.mkdir('fasttree_datasets')
-
-		for sp in spp_data:
-			spp_data[sp].parse_fasta_block(fasttree_main, polymorphs=polys)
-
-
-		# Write RAxML single phylip matrix
-
-		if not os.path.exists('raxml_datasets'):
-			os.mkdir('raxml_datasets')
-
-		tot_size = sum(part_collection['size'])
-		raxml_header = f" {len(spp_data)} {tot_size} \n"
-		with open(raxml_main, "a") as oh:
-			oh.write(raxml_header)
-		for sp in spp_data:
-			spp_data[sp].parse_phylip_block(raxml_main, name_space = (longest + 10), polymorphs=polys)
-
-
-		# Write RAxML partition file
-		with open(raxml_part, 'w') as ph:
-			init = 0
-			partinfo = ""
-
-			for ix, thtype in enumerate(part_collection['type']):
-				
-				if thtype == 'nucleic':
-					partinfo += 'GTR+I+G, '
-					
-				elif thtype == 'peptidic':
-					partinfo += 'Blosum62, '
-				
-				elif thtype == 'indel':
-					partinfo += 'BIN, '
-
-				elif thtype == 'morphological' or thtype == 'gene_content':
-					states = part_collection['states'][ix]
-					
-					if states == 2:
-						partinfo += 'BIN, '
-					elif states > 2:
-						partinfo += f"MULTI{states}_GTR, "
-					else:
-						raise ValueError(f"{thtype.capitalize()} partition is uninformative.")
-				
-				partinfo += f"p{ix+1} = {init+1}-{init + part_collection['size'][ix]}\n"
-				init += part_collection['size'][ix]
+		#TODO Check if output files already exist
 
-			ph.write(partinfo)
+		ya = datetime.now()
+		ya = ya.strftime('%B %d, %Y - %H:%M:%S')
+		log_bffr += f'{ya}\n\nCommand arguments: '
+		log_bffr += ' '.join(sys.argv) + '\n\n'
 
-		# Write xread file
 
-		if not os.path.exists('tnt_datasets'):
-			os.mkdir('tnt_datasets')
+		profiler = Profiler(profile)
+		hot_functions = cProfile.Profile() if profile_file else None
 
-		tot_size = sum([len(k) for k in part_collection['informative_chars']])
+		if hot_functions:
+			hot_functions.enable()
 
-		tnt_header = f"xread\n'File processed with BAD2matrix.'\n{tot_size} {len(spp_data)}\n"
-		
-		with open(tnt_main, 'w') as tnt_handle:
-			tnt_handle.write(tnt_header)
+		cache = PartitionCache(cache_dir, int(cache_size * 2 ** 20)) if cache_dir else None
+		profiler.start('total')
+		matrices = build_batch(infiles, infiles_morph, configs, full_fasta_names, 
+			columnar, processes, spool_dir = '.', profiler = profiler, memory = memory, 
+			cache = cache)
 
-		for sp in spp_data:
-			spp_data[sp].parse_tnt_block(tnt_main, name_space = (longest + 10), polymorphs=polys)
+		for name, matrix in matrices.items():
+			# Write phylip, fasta and xread matrices, and partition files
+			try:
+				matrix.write(name, compression, stream, stream_path)
 
-		with open(tnt_main, 'a') as tnt_handle:
-			tnt_handle.write(';\n')
+			# Remove temporary file
+			finally:
+				matrix.close()
 
+		profiler.stop('total')
 
-		# Remove temporary files
-		for name in spp_data:
-			spp_data[name].clean()
+		if hot_functions:
+			hot_functions.disable()
+			hot_functions.dump_stats(profile_file)
 
 
 		# Body of log file
-		log_bffr += 'Partitions processed:\n\n'
-
-		for idx , filename in enumerate(part_collection['file']):
-			log_bffr += f'{idx+1}: {filename}, {part_collection["type"][idx]} ({part_collection["size"][idx]} character{"s" if part_collection["size"][idx] > 1 else ""}).\n'		
-
-		print(log_bffr)
+		for idx, (name, matrix) in enumerate(matrices.items()):
+			if len(matrices) > 1:
+				settings = configs[name]
+				options = f"-a {settings['aa_encoding']} -m {round(settings['keep'] * 100)}"
+				options += ' -g' if not settings['code_gene_content'] else ''
+				options += ' -i' if not settings['code_indels'] else ''
+				log_bffr += f'Output files `{name}` ({options}):\n\n'
+			log_bffr += matrix.log(profile = idx == len(matrices) - 1)
+			if idx < len(matrices) - 1:
+				log_bffr += '\n'
+
+		if hot_functions:
+			stats_bffr = io.StringIO()
+			pstats.Stats(profile_file, stream=stats_bffr).sort_stats('tottime').print_stats(15)
+			log_bffr += f'\nHot functions (full profile saved in `{profile_file}`):\n'
+			log_bffr += stats_bffr.getvalue()
+
+		print(log_bffr, file = sys.stderr if stream and stream_path == '-' else sys.stdout)
 
 	else:
 		help_text = get_cli_help()
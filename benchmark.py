@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+from datetime import datetime
+from typing import List
+from sim_data import simulate_datasets
+from bad2matrix import build_matrix, Profiler, valid_fasta_ext
+
+try:
+	import resource
+except ImportError: # Not available on Windows
+	resource = None
+
+
+help_text = '''
+Times BAD2matrix on a synthetic dataset made by `sim_data.simulate_datasets`
+and appends the results to a JSON file, so runs of different commits can be
+compared. Every stage of the pipeline (indexing, processing, assembly, and
+each writer) is timed in process; the whole pipeline is also timed as a 
+separate run of `bad2matrix.py`.
+
+python benchmark.py [-t int] [-g int] [-l int] [--gaps float] [--missing float]
+	[--protein] [--morph int] [--poly float] [--wrap int] [--seed int]
+	[--args "bad2matrix arguments"] [-o results.json] [-k]
+
+-t          Number of terminals (default 100).
+-g          Number of genes (default 50).
+-l          Alignment length (default 1000).
+--gaps      Indel events per alignment column (default 0.05).
+--missing   Probability of a terminal lacking a gene (default 0.1).
+--protein   Simulate peptidic alignments instead of nucleic ones.
+--morph     Characters of a polymorphic morphological table (default 0).
+--poly      Frequency of polymorphic cells in the morphological table
+            (default 0.05).
+--wrap      Width of sequence lines (default 0, unwrapped).
+--seed      Seed of the random generator (default 0).
+--args      Extra arguments for the separate run of `bad2matrix.py` (e.g. 
+            "-c -p 4").
+-o          Results file (default `benchmark_results.json`).
+-k          Keep the synthetic dataset and the output matrices.
+'''
+
+
+def peak_memory(who: str = 'self') -> int:
+	"""
+	Peak resident set size in kilobytes of this process (`self`) or of its
+	finished children (`children`); None if it cannot be measured.
+	"""
+	if resource is None:
+		return None
+
+	usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+
+	if sys.platform == 'darwin': # Bytes in macOS
+		return usage.ru_maxrss // 1024
+
+	return usage.ru_maxrss
+
+
+class Stopwatch:
+
+	def __init__(self):
+		"""
+		Records wall and CPU time of named stages, along with the peak memory
+		of the process at the end of each one.
+		"""
+		self.stages = {}
+
+
+	def start(self):
+		self.wall = time.perf_counter()
+		self.cpu = time.process_time()
+
+
+	def stop(self, name: str):
+		self.stages[name] = {
+			'wall': round(time.perf_counter() - self.wall, 4),
+			'cpu': round(time.process_time() - self.cpu, 4),
+			'peak_rss_kb': peak_memory()
+			}
+
+
+# Profiler stages of `build_matrix` added up into a single benchmark stage, 
+# other stages (e.g. each writer) are kept as they are
+stage_groups = {
+	'file indexing': 'index',
+	'name mapping': 'name_map',
+	'partition parse': 'processing',
+	'indel coding': 'processing',
+	'informative stats': 'processing',
+	'partition wait': 'processing',
+	'spool write': 'assembly',
+	'feed': 'assembly',
+	'gene content coding': 'assembly'
+	}
+
+
+def pipeline_stages(profiler: Profiler) -> dict:
+	"""
+	Stages of a Profiler in the format of Stopwatch, grouped by `stage_groups`.
+	"""
+	out = {}
+
+	for name, stats in profiler.stages.items():
+		stage = out.setdefault(stage_groups.get(name, name), 
+			{'wall': 0.0, 'cpu': 0.0, 'peak_rss_kb': None})
+		stage['wall'] = round(stage['wall'] + stats['wall'], 4)
+		stage['cpu'] = round(stage['cpu'] + stats['cpu'], 4)
+
+		if stats['peak_rss'] is not None:
+			stage['peak_rss_kb'] = max(stage['peak_rss_kb'] or 0, stats['peak_rss'] // 1024)
+
+	return out
+
+
+def git_commit() -> str:
+	try:
+		out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+			text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+		return out.stdout.strip() or None
+
+	except OSError:
+		return None
+
+
+def run_benchmark(params: dict, bad2matrix_args: List = [], keep: bool = False) -> dict:
+	"""
+	Simulates a dataset, times the stages of `build_matrix` and `Matrix.write`
+	in process and a full run of `bad2matrix.py` in a child process. Returns
+	the record of the run.
+	"""
+	workdir = os.path.abspath(f'temporary_directory_for_benchmark_{os.getpid()}')
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bad2matrix.py')
+	watch = Stopwatch()
+
+	watch.start()
+	fasta_dir, morph_dir = simulate_datasets(workdir, **params)
+	watch.stop('simulation')
+
+	pattern = '|'.join(valid_fasta_ext)
+	infiles = [os.path.join(fasta_dir, x) for x in sorted(os.listdir(fasta_dir))
+		if re.search(f'\\.({pattern})$', x, re.I)]
+	infiles_morph = [] if morph_dir is None else [os.path.join(morph_dir, 'matrix.tsv')]
+
+	profiler = Profiler(True)
+	matrix = build_matrix(infiles, infiles_morph, profiler = profiler)
+	os.mkdir(os.path.join(workdir, 'in_process'))
+	matrix.write('benchmark', directory = os.path.join(workdir, 'in_process'))
+	matrix.close()
+	watch.stages.update(pipeline_stages(profiler))
+
+	command = [sys.executable, script, '-d', fasta_dir, '-n', 'benchmark']
+	if morph_dir:
+		command += ['-r', morph_dir]
+	command += bad2matrix_args
+
+	wall = time.perf_counter()
+	out = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+	wall = time.perf_counter() - wall
+
+	if out.returncode != 0:
+		raise RuntimeError(f"BAD2matrix run failed:\n{out.stderr}")
+
+	record = {
+		'date': datetime.now().isoformat(timespec='seconds'),
+		'commit': git_commit(),
+		'python': platform.python_version(),
+		'params': params,
+		'args': bad2matrix_args,
+		'input_bytes': sum([os.path.getsize(x) for x in infiles + infiles_morph]),
+		'stages': watch.stages,
+		'run': {'wall': round(wall, 4), 'peak_rss_kb': peak_memory('children')}
+		}
+
+	if not keep:
+		shutil.rmtree(workdir)
+
+	return record
+
+
+def compare(record: dict, previous: List[dict]):
+	"""
+	Prints the ratios of wall times between `record` and the last record of
+	`previous` with the same dataset parameters and arguments.
+	"""
+	same = [x for x in previous if x['params'] == record['params'] and x['args'] == record['args']]
+
+	if len(same) == 0:
+		return
+
+	last = same[-1]
+	print(f"Compared with commit {last['commit']} ({last['date']}):")
+
+	for stage in record['stages']:
+		if stage in last['stages'] and last['stages'][stage]['wall'] > 0:
+			print(f"  {stage}: {record['stages'][stage]['wall'] / last['stages'][stage]['wall']:.2f}x")
+
+	print(f"  full run: {record['run']['wall'] / last['run']['wall']:.2f}x")
+
+
+
+if __name__ == '__main__':
+	params = {'taxa': 100, 'genes': 50, 'length': 1000, 'gap_rate': 0.05, 'missing_rate': 0.1,
+		'protein': False, 'morph_chars': 0, 'poly_rate': 0.05, 'wrap': 0, 'seed': 0}
+	options = {'-t': 'taxa', '-g': 'genes', '-l': 'length', '--morph': 'morph_chars',
+		'--wrap': 'wrap', '--seed': 'seed'}
+	rate_options = {'--gaps': 'gap_rate', '--missing': 'missing_rate', '--poly': 'poly_rate'}
+	results_file = 'benchmark_results.json'
+	bad2matrix_args = []
+	keep = False
+
+	for iar, ar in enumerate(sys.argv):
+
+		if ar in options:
+			params[options[ar]] = int(sys.argv[iar+1])
+
+		elif ar in rate_options:
+			params[rate_options[ar]] = float(sys.argv[iar+1])
+
+		elif ar == '--protein':
+			params['protein'] = True
+
+		elif ar == '--args':
+			bad2matrix_args = sys.argv[iar+1].split()
+
+		elif ar == '-o':
+			results_file = sys.argv[iar+1]
+
+		elif ar == '-k':
+			keep = True
+
+		elif ar == '-h' or ar == '--help':
+			print(help_text)
+			exit()
+
+	record = run_benchmark(params, bad2matrix_args, keep)
+	previous = []
+
+	if os.path.exists(results_file):
+		with open(results_file) as fhandle:
+			previous = json.load(fhandle)
+
+	print(json.dumps(record, indent=1))
+	compare(record, previous)
+
+	with open(results_file, 'w') as fhandle:
+		json.dump(previous + [record], fhandle, indent=1)
+
+	exit()
@@ -1,7 +1,7 @@
 import os
-import subprocess
 import shutil
-import re
+import random
+from bad2matrix import build_matrix
 
 seq0 = "TGCGGAAG-ATCATTGTCGAAAACC-----AGCAGAAAACCCGCGAACTCGTCTGTACTCTTGGGAAA--"
 seq1 = "-GCGGTTG-ATCATTGTCGAAAACCT---AAGCAGTTTTCCCGCGAACTCGTCTGTACTCTTGGGTTTTG"
@@ -20,8 +20,13 @@ gen_content = {
 }
 
 def generate_datasets(dir_name = 'temporary_directory_for_testing'):
+	"""
+	Writes the alignments into `dir_name`, or only returns them as in-memory
+	files ({file name: content}) if `dir_name` is None.
+	"""
+	datasets = {}
 
-	if not os.path.exists(dir_name):
+	if dir_name and not os.path.exists(dir_name):
 		os.mkdir(dir_name)
 
 	for igen, gen in enumerate(gen_content['sp0']):
@@ -38,10 +43,89 @@ def generate_datasets(dir_name = 'temporary_directory_for_testing'):
 				else:
 					bffr += f'{seq1}\n'
 		
-		file_name = os.path.join(dir_name, f'gene_{igen}.fasta')
+		datasets[f'gene_{igen}.fasta'] = bffr
+
+		if dir_name:
+			with open(os.path.join(dir_name, f'gene_{igen}.fasta'), 'w') as fhandle:
+				fhandle.write(bffr)
+
+	return datasets
+
+
+def simulate_datasets(dir_name='temporary_directory_for_benchmark', taxa=10, 
+	genes=6, length=70, gap_rate=0.05, missing_rate=0.1, protein=False, 
+	morph_chars=0, poly_rate=0.0, wrap=0, seed=0):
+	"""
+	Writes a random dataset of `genes` alignments of `length` columns for 
+	`taxa` terminals into `dir_name/fastas`, and optionally a morphological 
+	table of `morph_chars` characters into `dir_name/morphology`. Sequences 
+	derive from a single ancestor, so that some columns are informative. 
+	`gap_rate` is the number of indel events per column, each shared by a 
+	random subset of terminals; `missing_rate` is the probability of a 
+	terminal lacking a gene; `poly_rate` is the frequency of polymorphic 
+	cells in the morphological table; `wrap` is the width of sequence lines 
+	(0 means unwrapped). Returns the paths of both folders (None if empty).
+	"""
+	rand = random.Random(seed)
+	alphabet = 'ACDEFGHIKLMNPQRSTVWY' if protein else 'ACGT'
+	names = [f'sp{x}' for x in range(taxa)]
+	fasta_dir = os.path.join(dir_name, 'fastas')
+	morph_dir = None
+
+	os.makedirs(fasta_dir, exist_ok=True)
+
+	for igen in range(genes):
+		ancestor = rand.choices(alphabet, k=length)
+		present = [x for x in names if rand.random() >= missing_rate]
+
+		if len(present) < 4:
+			present = rand.sample(names, min(4, taxa))
+
+		seqs = {}
+		for name in present:
+			seq = ancestor[:]
+			for icol in rand.sample(range(length), length // 10):
+				seq[icol] = rand.choice(alphabet)
+			seqs[name] = seq
+
+		for _ in range(int(gap_rate * length)):
+			init = rand.randrange(length)
+			end = min(length, init + rand.randint(1, 10))
+
+			for name in rand.sample(present, rand.randint(1, len(present))):
+				seqs[name][init:end] = '-' * (end - init)
+
+		bffr = []
+		for name in present:
+			seq = ''.join(seqs[name])
+			if wrap > 0:
+				seq = '\n'.join([seq[x : x + wrap] for x in range(0, length, wrap)])
+			bffr.append(f'>{name}\n{seq}\n')
+
+		with open(os.path.join(fasta_dir, f'gene_{igen}.fasta'), 'w') as fhandle:
+			fhandle.write(''.join(bffr))
+
+	if morph_chars > 0:
+		morph_dir = os.path.join(dir_name, 'morphology')
+		os.makedirs(morph_dir, exist_ok=True)
+		states = ['absent', 'present', 'reduced', 'fused']
+		bffr = ['Taxon\t' + '\t'.join([f'char_{x}' for x in range(morph_chars)])]
+
+		for name in names:
+			row = [name]
+			for _ in range(morph_chars):
+				if rand.random() < poly_rate:
+					row.append('|'.join(rand.sample(states, 2)))
+				elif rand.random() < missing_rate:
+					row.append('?')
+				else:
+					row.append(rand.choice(states))
+			bffr.append('\t'.join(row))
+
+		with open(os.path.join(morph_dir, 'matrix.tsv'), 'w') as fhandle:
+			fhandle.write('\n'.join(bffr) + '\n')
 
-		with open(file_name, 'w') as fhandle:
-			fhandle.write(bffr)
+	return (fasta_dir, morph_dir)
 
 
 def clean(dir_name, matrix_rootname):
@@ -62,19 +146,16 @@ def clean(dir_name, matrix_rootname):
 		shutil.rmtree('tnt_datasets')
 
 
-def verify_gene_content(matrix_rootname):
+def verify_gene_content(matrix):
+	"""
+	Compares the gene content partition of a `bad2matrix.Matrix` with the 
+	simulated absence/presence.
+	"""
 	out = True
 	encoded = {}
 
-	with open(f'iqtree_datasets/{matrix_rootname}_gene_content.phy', 'r') as fh:
-	
-		for line in fh:
-			line = line.strip()
-	
-			if line.startswith('s'):
-				bits = re.split(r'\s+', line)
-				lista = [int(x) for x in bits[1]]
-				encoded[bits[0]] = lista
+	for term, row in matrix.sequences('gene_content').items():
+		encoded[term] = [int(x) for x in row]
 
 	for key in encoded:
 		
@@ -89,11 +170,9 @@ def verify_gene_content(matrix_rootname):
 	return out
 
 if __name__ == '__main__':
-	folder_name = 'temporary_directory_for_gene_content_testing'
-	matrix_root = 'devtest'
-	generate_datasets(folder_name)
-	subprocess.call(['python' ,'bad2matrix.py','-d', folder_name, '-f', '-n', matrix_root])	
-	result = verify_gene_content(matrix_root)
+	datasets = generate_datasets(None)
+	matrix = build_matrix(datasets, full_fasta_names = True)
+	result = verify_gene_content(matrix)
+	matrix.close()
 	print(f'{result=}')
-	clean(folder_name, matrix_root)
 	exit()
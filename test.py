@@ -1,5 +1,17 @@
 import os
-from bad2matrix import get_name_map, clean_name, Partition, Term_data, min_steps_char, max_steps_char
+import random
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from itertools import combinations
+from bad2matrix import get_name_map, clean_name, Partition, Term_data, min_steps_char, max_steps_char, CharMatrix, \
+	column_histograms, informative_columns, state_masks, stand_states, min_steps_signature, \
+	gap_runs, nested_intervals, Spool, process_partition, Polymorphs, \
+	compile_translation, pep2numb, index_file, presence_index, occupancy_distribution, \
+	Profiler, build_matrix, PresenceMatrix, SpooledPartition, RunningGaps, compressors, \
+	PartitionCache, build_matrices, translate_histogram, aa_redux_dict, build_batch, read_manifest, \
+	MatrixServer, send_request, plan_matrix, sample_alignment
 
 infiles = ['alg_test_0.fasta', 'alg_test_1.fasta', 'alg_test_2.fasta']
 
@@ -127,6 +139,13 @@ def test_partition_indel():
 	assert part0.metadata['type'] == ['nucleic', 'indel']
 
 
+def test_gap_runs():
+	assert gap_runs('--TT-A---C--') == [(4, 5), (6, 9)]
+	assert gap_runs(b'--TT-A---C--') == [(4, 5), (6, 9)]
+	assert gap_runs('-----') == []
+	assert nested_intervals([(1, 5), (1, 7), (2, 4), (3, 9), (6, 8)]) == [True, True, False, True, False]
+
+
 def test_min_steps_char():
 
 	assert min_steps_char({"A": 1, "T": 2}, "nucleic") == 1
@@ -144,6 +163,29 @@ def test_max_steps_char():
 	assert max_steps_char({'A': 3, 'T': 44, 'W':50}, "nucleic") == 3
 
 
+def test_step_signatures():
+	masks = state_masks['nucleic']
+	assert masks['R'] == masks['A'] | masks['G']
+	assert masks['N'] == masks['A'] | masks['C'] | masks['G'] | masks['T']
+	# Y+V and H+B share C, which is taken for both pairs
+	assert min_steps_char({'Y': 5, 'V': 2, 'H': 5, 'B': 3}, 'nucleic') == 0
+	min_steps_char({'T': 3, 'A': 1}, 'nucleic')
+	hits = min_steps_signature.cache_info().hits
+	min_steps_char({'A': 7, 'T': 2}, 'nucleic')
+	assert min_steps_signature.cache_info().hits == hits + 1
+	# B+D share G and T, only T is shared with H
+	assert min_steps_char({'B': 1, 'D': 1, 'H': 1}, 'nucleic') == 0
+	rand = random.Random(0)
+	for char_type in state_masks:
+		symbols = sorted(state_masks[char_type])
+		stand = sorted(x for x in symbols if x in stand_states[char_type])
+		for i in range(200):
+			states = tuple(sorted(rand.sample(symbols, rand.randint(2, 5))))
+			exhaustive = next(size for size in range(len(stand) + 1) for combo in combinations(stand, size)
+				if all(any(state_masks[char_type][x] & state_masks[char_type][y] for x in combo) for y in states))
+			assert min_steps_signature(states, char_type) == exhaustive - 1
+
+
 def test_informative_stats():
 	
 	part0.informative_stats()
@@ -154,6 +196,24 @@ def test_informative_stats():
 	assert part1.metadata['informative_chars'][1] == [0]
 
 
+def test_column_histograms():
+	hists = column_histograms(['AAT-T', 'A?--A', 'GRRAA'])
+	assert hists[0] == {'A': 2, 'T': 2}
+	assert list(hists[2]) == ['G', 'R', 'A']
+	assert informative_columns(hists, 'nucleic') == [0]
+	assert informative_columns(column_histograms(['AAKTT', 'AG-TA', 'AAGGT']), 'nucleic') == [0, 2]
+
+
+def test_columnar_partition():
+	colpart = Partition(infiles[0], name_map, columnar=True)
+	colpart.indel_coder()
+	colpart.informative_stats()
+	assert isinstance(colpart.data, CharMatrix)
+	assert colpart.data.column(0) == b'T---'
+	assert dict(colpart.data) == part0.data
+	assert colpart.metadata['informative_chars'] == part0.metadata['informative_chars']
+
+
 
 def test_term_data():
 
@@ -185,16 +245,333 @@ def test_term_data():
 		(80, 'nucleic', [5, 53, 78], True),
 		(3, 'indel', [0], True)]
 
-sp0dat = Term_data('sp0')
-sp3dat = Term_data('sp3')
-sp4dat = Term_data('sp4')
+def test_process_partition():
+	part = process_partition(infiles[0], name_map, columnar=True)
+	assert dict(part.data) == part0.data
+	assert part.metadata['informative_chars'] == part0.metadata['informative_chars']
+
+
+def test_spooled_partition():
+	seq = b'--TT-A---C--'
+	gaps = RunningGaps()
+	for init in range(0, len(seq), 3):
+		gaps.add(seq[init:init + 3], init)
+	assert list(gaps) == gap_runs(seq)
+	spool = Spool(directory=None)
+	part = SpooledPartition(infiles[0], name_map, spool, memory=50)
+	part.indel_coder()
+	part.informative_stats()
+	assert dict(part.data) == part0.data
+	assert part.metadata['size'] == part0.metadata['size']
+	assert part.metadata['informative_chars'] == part0.metadata['informative_chars']
+	assert spool.blocks[0]['width'] == 70
+	spool.close()
+
+
+def test_presence_index():
+	presence = presence_index({'a.fa': ['sp0', 'sp1'], 'b.fa': ['sp0'], 'c.fa': ['sp0', 'sp2']})
+	assert presence == {'sp0': 0b111, 'sp1': 0b001, 'sp2': 0b100}
+	assert occupancy_distribution(presence) == {1: 2, 3: 1}
+
+
+def test_presence_matrix():
+	genes = PresenceMatrix(['sp0', 'sp1', 'sp2', 'sp3', 'sp4'])
+	genes.add('a.fa', ['sp0', 'sp1', 'sp2'])
+	genes.add('b.fa', ['sp0', 'sp1', 'sp2', 'sp3', 'sp4'])
+	genes.add('c.fa', ['sp4', 'sp3'])
+	assert len(genes) == 3
+	assert genes.gene_occupancy() == [3, 5, 2]
+	assert genes.taxon_occupancy() == {'sp0': 2, 'sp1': 2, 'sp2': 2, 'sp3': 2, 'sp4': 2}
+	assert genes.transpose()['sp0'] == '110'
+	assert genes.transpose(['sp4', 'sp1'])['sp4'] == '011'
+	assert genes.informative() == [0, 2]
+	assert genes.informative(['sp0', 'sp1', 'sp3']) == []
+
+
+def test_index_file():
+	index = index_file(infiles[1])
+	assert index['file_type'] == 'fasta'
+	assert index['names'] == ['sp0#sample0', 'sp1#sample1', 'sp2#sample0', 'sp4#sample0']
+	assert index['length'] == 80
+	assert index['type'] == 'nucleic'
+	part = Partition(infiles[0], name_map, index=index_file(infiles[0]))
+	assert part.data == Partition(infiles[0], name_map).data
+	part = Partition(infiles[0], {'sp1#sample0': 'sp1'})
+	assert list(part.data.keys()) == ['sp1']
+
+
+def test_wrapped_fasta():
+	with open('wrapped.fasta', 'w') as fh:
+		fh.write('>sp0\r\nacgt\r\nac-t\r\n>sp1\r\n>sp2\r\nACGT\r\nAcgn')
+	index = index_file('wrapped.fasta')
+	assert index['names'] == ['sp0', 'sp1', 'sp2']
+	assert index['length'] == 8
+	part = Partition('wrapped.fasta', {'sp0': 'sp0', 'sp1': 'sp1', 'sp2': 'sp2'}, index=index)
+	assert part.data == {'sp0': 'ACGTAC-T', 'sp2': 'ACGTACGN'}
+	with open('wrapped.fasta', 'a') as fh:
+		fh.write('\n>sp3\nAC*TACGT\n')
+	try:
+		Partition('wrapped.fasta', {'sp0': 'sp0', 'sp3': 'sp3'})
+		assert False
+	except ValueError as err:
+		assert '`*`' in str(err)
+	os.remove('wrapped.fasta')
+
+
+def test_compressed_input():
+	for ext, module in compressors.items():
+		with open(infiles[0], 'rb') as fh, module.open(f'{infiles[0]}.{ext}', 'wb') as zh:
+			zh.write(fh.read())
+		index = index_file(f'{infiles[0]}.{ext}')
+		assert index['file_type'] == 'fasta'
+		plain = index_file(infiles[0])
+		for key in ('names', 'offsets', 'length', 'type'):
+			assert index[key] == plain[key]
+		part = Partition(f'{infiles[0]}.{ext}', name_map, index=index)
+		assert part.data == Partition(infiles[0], name_map).data
+		os.remove(f'{infiles[0]}.{ext}')
+
+
+def test_spool():
+	spool = Spool(capacity=16)
+	assert spool.add(part0.data) == 0
+	assert spool.add({'sp0': 'a' * 5000, 'sp9': 'b' * 5000}) == 1
+	assert spool.add({'sp0': '\u0190\u0191', 'sp3': '01'}) == 2
+	assert spool.read(0, 'sp3') == part0.data['sp3']
+	assert spool.read(1, 'sp3') is None
+	assert spool.read(1, 'sp9') == 'b' * 5000
+	assert spool.read(2, 'sp0') == '\u0190\u0191'
+	assert spool.blocks[2]['encoding'] == 'utf-32-le'
+	spool.close()
+	assert not os.path.exists(spool.file)
+	spool = Spool(capacity=16, directory=None)
+	spool.add({'sp0': 'a' * 5000, 'sp9': 'b' * 5000})
+	spool.add({'sp0': 'c' * 9000})
+	assert spool.capacity > 16384
+	assert spool.read(0, 'sp9') == 'b' * 5000
+	assert spool.read(1, 'sp0') == 'c' * 9000
+	spool.close()
+
+
+def test_compile_translation():
+	table = compile_translation({'a': 'b', 'b': '[bc]', 'c': 'a'})
+	assert 'abc'.translate(table) == '[ba][ba]a'
+	table = compile_translation(pep2numb)
+	assert 'MNYBX-'.translate(table) == 'A[2B][79][2B]?-'
+
+
+def test_polymorphs():
+	polys = Polymorphs()
+	code = polys.add_poly_encoding('[01]')
+	assert polys.add_poly_encoding('[01]') == code
+	assert polys.add_poly_encoding('[12]') != code
+	assert ('a' + code).translate(polys.table()) == 'a[01]'
+	assert ('a' + code).translate(polys.table('?')) == 'a?'
+	hists = column_histograms(['001' + code * 2, '0011' + code])
+	assert informative_columns(hists, 'morphological') == [1]
+	for i in range(7000):
+		last = polys.add_poly_encoding(f'[{i}{i}]')
+	assert len(polys.mapping) == 7002
+	assert ord(last) > 0xF0000
+
+
+def test_term_blocks():
+	spool = Spool()
+	term = Term_data('sp3', True, spool)
+	spool.add(part0.data)
+	term.feed(part0)
+	data = term.read()
+	assert data == part0.data['sp3']
+	assert term.phylip_block(data, 5, 'indel', Polymorphs()) == 'sp3  0110\n'
+	assert term.fasta_block(data, Polymorphs()) == '>sp3\n' + part0.data['sp3'][:70] + '\n'
+	assert term.tnt_block(data, 5, Polymorphs()) == 'sp3  20111110\n'
+	spool.close()
+
+
+def test_profiler():
+	profiler = Profiler(True)
+	part = process_partition(infiles[0], name_map, profiler=profiler)
+	assert list(profiler.stages.keys()) == ['partition parse', 'indel coding', 'informative stats']
+	plain = process_partition(infiles[0], name_map)
+	assert part.data == plain.data
+	assert part.metadata == plain.metadata
+	assert part.metadata['type'] == ['nucleic', 'indel']
+	profiler.start('writer', False)
+	profiler.stop('writer', written=10)
+	profiler.merge({'writer': dict(profiler.stages['writer'])})
+	assert profiler.stages['writer']['calls'] == 2
+	assert profiler.stages['writer']['written'] == 20
+	assert 'informative stats' in profiler.report()
+	profiler = Profiler()
+	profiler.start('nothing')
+	profiler.stop('nothing')
+	assert profiler.stages == {}
+
+
+def test_build_matrix():
+	matrix = build_matrix(infiles)
+	in_memory = build_matrix({x: y for x, y in zip(infiles, dummy)})
+	assert in_memory.spool.file is None
+	assert in_memory.partitions.rows() == matrix.partitions.rows()
+	assert in_memory.sequences() == matrix.sequences()
+	assert in_memory.render('test') == matrix.render('test')
+	assert matrix.sequences('gene_content')['sp4'] == '01'
+	assert os.path.join('tnt_datasets', 'test.ss') in matrix.render('test')
+	matrix.close()
+	in_memory.close()
+
+
+def test_compressed_output():
+	matrix = build_matrix(infiles)
+	texts = matrix.render('test')
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as tmp:
+		os.chdir(tmp)
+		matrix.write('test', 'gzip', 'tnt', 'stream.ss')
+		matrix.write('xz', 'xz')
+		try:
+			matrix.write('none', stream='peptidic')
+			assert False
+		except ValueError as err:
+			assert '`peptidic`' in str(err)
+		os.chdir(cwd)
+		for path, text in texts.items():
+			if path.endswith('.ss'):
+				with open(os.path.join(tmp, 'stream.ss')) as fh:
+					assert fh.read() == text
+			elif path.endswith('.nex') or path.endswith('.part'):
+				continue
+			else:
+				with compressors['gz'].open(os.path.join(tmp, f'{path}.gz'), 'rt') as fh:
+					assert fh.read() == text
+		assert not os.path.exists(os.path.join(tmp, 'tnt_datasets', 'test.ss.gz'))
+		assert os.path.exists(os.path.join(tmp, 'tnt_datasets', 'xz.ss.xz'))
+		with open(os.path.join(tmp, 'iqtree_datasets', 'test.nex')) as fh:
+			assert 'test_nucleic.phy.gz: 1-70;' in fh.read()
+	matrix.close()
+
+
+def test_partition_cache():
+	plain = build_matrix(infiles)
+	with tempfile.TemporaryDirectory() as tmp:
+		cache = PartitionCache(tmp)
+		first = build_matrix(infiles, cache = cache)
+		assert cache.hits == []
+		assert len(os.listdir(tmp)) == len(infiles)
+		second = build_matrix(infiles, cache = cache)
+		assert cache.hits == sorted(infiles)
+		assert second.render('test') == plain.render('test')
+		assert second.partitions.rows() == plain.partitions.rows()
+		build_matrix(infiles, full_fasta_names = True, cache = cache).close()
+		assert len(cache.hits) == len(infiles) # Terminal names changed
+		assert len(os.listdir(tmp)) == 2 * len(infiles)
+		largest = max(cache.entries.values())
+		PartitionCache(tmp, max_size = 1).evict()
+		assert os.listdir(tmp) == []
+		limited = PartitionCache(os.path.join(tmp, 'limited'), max_size = largest)
+		build_matrix(infiles, cache = limited).close()
+		assert 0 < limited.total <= largest
+		assert sorted(limited.entries) == sorted(x.path for x in os.scandir(limited.directory))
+		for matrix in [first, second]:
+			matrix.close()
+	plain.close()
+
+
+def test_alphabets():
+	peptides = {'pep.fasta': {'sp0': 'MKLV-EAQ', 'sp1': 'MRIV-DAQ', 'sp2': 'MKLVWEGQ', 
+		'sp3': 'MRLVWDSE', 'sp4': 'MKIF-EGE'}}
+	histogram = translate_histogram(Counter('AKRKM'), aa_redux_dict('2'))
+	assert list(histogram.items()) == [('F', 2), ('E', 3)]
+	matrices = build_matrices(peptides, aa_encodings = ['20', '6dso', '2'])
+	assert list(matrices) == ['20', '6dso', '2']
+	for code, matrix in matrices.items():
+		alone = build_matrix(peptides, aa_encoding = code)
+		assert matrix.partitions.rows() == alone.partitions.rows()
+		assert matrix.render('test') == alone.render('test')
+		alone.close()
+		matrix.close()
+
+
+def test_batch():
+	with tempfile.NamedTemporaryFile('w', suffix = '.txt', delete = False) as fh:
+		fh.write('# sweep\nfull\nno_gc -g\n\nhalf -m 67 -i\npep -a 20,6dso -g\n')
+	configs = read_manifest(fh.name)
+	os.remove(fh.name)
+	assert list(configs) == ['full', 'no_gc', 'half', 'pep_20', 'pep_6dso']
+	assert configs['half'] == {'keep': 0.67, 'code_indels': False, 'code_gene_content': True, 
+		'aa_encoding': '20'}
+	matrices = build_batch(infiles, configs = configs)
+	assert list(matrices) == list(configs)
+	assert len(matrices['half'].files) == 2
+	for name, matrix in matrices.items():
+		settings = configs[name]
+		alone = build_matrix(infiles, keep = settings['keep'], code_indels = settings['code_indels'], 
+			code_gene_content = settings['code_gene_content'], aa_encoding = settings['aa_encoding'])
+		assert matrix.partitions.rows() == alone.partitions.rows()
+		assert matrix.render(name) == alone.render(name)
+		alone.close()
+		matrix.close()
+
+
+def test_server():
+	with tempfile.TemporaryDirectory() as tmp:
+		in_dir = os.path.join(tmp, 'in')
+		os.mkdir(in_dir)
+		paths = [shutil.copy(x, in_dir) for x in infiles]
+		server = MatrixServer(in_dir)
+		for options in ['-g', '-m 67 -i', '-g']:
+			response = server.handle({'name': 'test', 'options': options, 'render': True})
+			assert response['status'] == 'ok'
+		assert len(server.cache.hits) == len(infiles)
+		alone = build_matrix(sorted(paths), code_gene_content = False)
+		assert response['outputs']['test'] == alone.render('test')
+		alone.close()
+		response = server.handle({'name': 'test', 'output': os.path.join(tmp, 'out')})
+		assert os.path.join(tmp, 'out', 'tnt_datasets', 'test.ss') in response['outputs']['test']
+		with open(paths[0], 'a') as fh:
+			fh.write('>sp9#sample0\n' + dummy[0].split()[1].replace('T', 'A') + '\n')
+		response = server.handle({'name': 'test', 'render': True})
+		assert response['changed'] == [paths[0]]
+		assert 'sp9' in response['outputs']['test'][os.path.join('tnt_datasets', 'test.ss')]
+		assert server.handle({'name': 'test', 'options': '-x'})['status'] == 'error'
+		socket_path = os.path.join(tmp, 'b2m.sock')
+		thread = threading.Thread(target=server.serve, args=(socket_path,))
+		thread.start()
+		assert server.ready.wait(30)
+		assert send_request(socket_path, {'command': 'status'})['files'] == len(infiles)
+		assert send_request(socket_path, {'command': 'stop'})['status'] == 'ok'
+		thread.join()
+
+
+def test_plan():
+	plan = plan_matrix(infiles, root_name = 'test')
+	matrix = build_matrix(infiles)
+	texts = matrix.render('test')
+	assert plan['retained'] == len(infiles)
+	assert plan['files'][infiles[0]]['taxa'] == 4
+	assert plan['files'][infiles[0]]['length'] == 70
+	assert plan['terminals'] == len(matrix.terminals)
+	assert plan['width'] == sum(matrix.partitions.column('size'))
+	for path, size in plan['outputs'].items():
+		if not path.endswith('.ss'):
+			assert size == len(texts[path])
+	assert plan['runtime'] > 0 and plan['memory'] > 0
+	matrix.close()
+	sample = sample_alignment(index_file(infiles[0]), windows = 4, window_size = 8)
+	records = dummy[0].split()
+	for name, widths in [('even.fasta', [20, 20, 20, 20]), ('uneven.fasta', [10, 30, 30])]:
+		with open(name, 'w') as fh:
+			for head, seq in zip(records[::2], records[1::2]):
+				fh.write(head + '\n')
+				for width in widths:
+					fh.write(seq[:width] + '\n')
+					seq = seq[width:]
+		assert sample_alignment(index_file(name), windows = 4, window_size = 8) == sample
+		os.remove(name)
+
 
 def test_final_cleanup():
 
 	for fi in infiles:
 		os.remove(fi)
 
-	os.remove(sp0dat.file)
-	os.remove(sp3dat.file)
-	os.remove(sp4dat.file)
-